@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import socket
+import time
+
+from .udp import DrefClient, DrefFilter, beacon_socket
+
+logger = logging.getLogger(__name__)
+
+
+class XPlaneProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client: "AsyncUDP"):
+        self._client = client
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]):
+        self._client._datagram_received(memoryview(data), time.perf_counter_ns())
+
+    def error_received(self, exc: Exception):
+        logger.warning(f"X-Plane socket error {str(exc)}")
+
+
+class BeaconProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client: "AsyncUDP"):
+        self._client = client
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]):
+        self._client._beacon_received(data, addr)
+
+
+class AsyncUDP(DrefClient):
+    """asyncio X-Plane UDP client
+
+    Same API as `dref.udp.UDP` but runs on the event loop, change callbacks
+    are called directly from `datagram_received`
+    """
+
+    def __init__(
+        self,
+        drefs: list[str],
+        on_drefs_changed: callable = None,
+        use_numpy: bool = False,
+        write_window: float = 0.02,
+        rate: int = 5,
+        adaptive_rate: int = None,
+        adaptive_hold: float = 2.0,
+        recorder=None,
+        latency_stats: bool = False,
+        stats_interval: float = 10.0,
+        rcvbuf: int = None,
+        data_groups: list[int] = None,
+        data_port: int = None,
+        filters: dict[str, DrefFilter] = None,
+    ):
+        super().__init__(
+            drefs,
+            on_drefs_changed,
+            use_numpy=use_numpy,
+            write_window=write_window,
+            rate=rate,
+            adaptive_rate=adaptive_rate,
+            adaptive_hold=adaptive_hold,
+            recorder=recorder,
+            latency_stats=latency_stats,
+            stats_interval=stats_interval,
+            data_groups=data_groups,
+            filters=filters,
+        )
+        self._data_port = data_port or 0
+        self._rcvbuf = rcvbuf
+        self._transport: asyncio.DatagramTransport = None
+        self._beacon_transport: asyncio.DatagramTransport = None
+        self._beacon_task: asyncio.Task = None
+        self._write_handle: asyncio.TimerHandle = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: XPlaneProtocol(self), local_addr=("0.0.0.0", self._data_port)
+        )
+        if self._rcvbuf:
+            sock = self._transport.get_extra_info("socket")
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._rcvbuf)
+        self._beacon_transport, _ = await loop.create_datagram_endpoint(
+            lambda: BeaconProtocol(self), sock=beacon_socket()
+        )
+        self._beacon_task = loop.create_task(self.beacon_task())
+
+    async def close(self):
+        if self._beacon_task:
+            self._beacon_task.cancel()
+            try:
+                await self._beacon_task
+            except asyncio.CancelledError:
+                pass
+
+        if self._beacon_transport:
+            self._beacon_transport.close()
+
+        if self._write_handle:
+            self._write_handle.cancel()
+            self._flush()
+
+        if self._transport:
+            if self._xplane_address:
+                self._subscribe(0)
+            self._transport.close()
+        logger.info("closed")
+
+    @property
+    def online(self):
+        return bool(self._xplane_address)
+
+    def _on_beacon_changed(self, beacon: dict[str, any] | None):
+        self._xplane_address = (beacon["ip"], beacon["port"]) if beacon else ()
+        if beacon:
+            logger.info("Subscribing to drefs")
+            self._subscribe()
+
+    async def beacon_task(self):
+        while True:
+            await asyncio.sleep(1)
+            self._log_latency()
+            self._beacon.check()
+            self._expire_adaptive()
+
+    def _send(self, msg: bytes):
+        if not self._xplane_address:
+            logger.warning("X-Plane not available")
+            return
+        self._transport.sendto(msg, self._xplane_address)
+
+    def _beacon_received(self, data: bytes, addr: tuple[str, int]):
+        if self._recorder:
+            self._recorder.record(data)
+        self._beacon.process(data, addr)
+
+    @property
+    def write_stats(self):
+        return self._write_queue.stats
+
+    def _schedule_flush(self):
+        if self._write_handle is None:
+            loop = asyncio.get_running_loop()
+            self._write_handle = loop.call_later(self._write_window, self._flush)
+
+    def _flush(self):
+        self._write_handle = None
+        messages = self._write_queue.drain()
+        if not self._xplane_address:
+            logger.warning(f"X-Plane not available, dropped {len(messages)} writes")
+            return
+        for msg in messages:
+            self._send(msg)
+
+    def set_dref(self, dref: str, value: any):
+        logger.debug(f"set dref {dref} {value}")
+        self._write_queue.put_dref(dref, value)
+        self._schedule_flush()
+
+    def execute_command(self, command: str):
+        self._write_queue.put_command(command)
+        self._schedule_flush()
+
+
+if __name__ == "__main__":
+
+    def on_drefs_changed(drefs: dict[str, any]):
+        print("drefs", drefs)
+
+    async def main():
+        udp = AsyncUDP(["sim/cockpit/autopilot/heading_mag,0"], on_drefs_changed)
+        await udp.start()
+        try:
+            while True:
+                await asyncio.sleep(1)
+        finally:
+            await udp.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
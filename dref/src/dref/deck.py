@@ -11,6 +11,8 @@ class Deck:
         self._decks = DeviceManager().enumerate()
         self._deck = None
         self._key_change_callback = None
+        # Native image currently shown per key
+        self._key_images: dict[int, bytes] = {}
 
         for index, deck in enumerate(self._decks):
             # if (deck_id is None and index != 0) or index != deck_id:
@@ -35,6 +37,7 @@ class Deck:
 
     def reset(self):
         self._deck.reset()
+        self._key_images = {}
 
     @property
     def key_count(self):
@@ -53,10 +56,20 @@ class Deck:
         if self._key_change_callback is not None:
             await self._key_change_callback(key, state)
 
+    def to_native(self, image: Image):
+        return PILHelper.to_native_key_format(self._deck, image)
+
     def update_key(self, key: int, image: Image):
-        deck_image = PILHelper.to_native_key_format(self._deck, image)
+        self.update_key_native(key, self.to_native(image))
+
+    def update_key_native(self, key: int, deck_image: bytes):
+        """Set a key image already in native format, skipped if unchanged"""
+        current = self._key_images.get(key)
+        if current is deck_image or current == deck_image:
+            return
         with self._deck:
             self._deck.set_key_image(key, deck_image)
+        self._key_images[key] = deck_image
 
     def close(self):
         with self._deck:
@@ -1,4 +1,5 @@
 import asyncio
+from collections import OrderedDict
 from dataclasses import dataclass, field
 from ruamel import yaml
 import os
@@ -17,21 +18,25 @@ def translate_press(value: int):
 
 
 def translate_press_iterate(max_iterate: str, char_id: str = None, length: int = None):
+    max_iterate = int(max_iterate)
+    char_id = None if char_id is None else int(char_id)
+    length = None if length is None else int(length)
+
     def translate_iterate(value: int):
-        if char_id:
+        if char_id is not None:
             if not isinstance(value, int):
                 value = int(value)
             str_value = f"{value:0{length}d}"
-            value = int(str_value[int(char_id)])
+            value = int(str_value[char_id])
 
-        if value == int(max_iterate) - 1:
+        if value == max_iterate - 1:
             value = 0
         else:
             value += 1
 
-        if char_id:
+        if char_id is not None:
             str_list = list(str_value)
-            str_list[int(char_id)] = str(value)
+            str_list[char_id] = str(value)
             value = int("".join(str_list))
         return value
 
@@ -42,10 +47,12 @@ PRESS_TRANSLATORS = {"translate_press_iterate": translate_press_iterate}
 
 
 def command_press_iterate(max_iterate: str):
+    max_iterate = int(max_iterate)
+
     def command_press(
         value, command_up: Callable[[], None], command_down: Callable[[], None]
     ):
-        if value == int(max_iterate) - 1:
+        if value == max_iterate - 1:
             for i in range(max_iterate):
                 command_down()
         else:
@@ -59,6 +66,7 @@ COMMAND_TRANSLATORS = {"command_press_iterate": command_press_iterate}
 
 def translate_dref_character(char_id: str, length: int = 4):
     char_id = int(char_id)
+    length = int(length)
 
     def translate_dref(value: int):
         if not isinstance(value, int):
@@ -74,6 +82,8 @@ def translate_dref_character(char_id: str, length: int = 4):
 
 def translate_dref_value_bool(compare_value: str, comparator="equal"):
     compare_value = int(compare_value)
+    if comparator not in ("equal", "greater"):
+        raise ValueError(f"Unknown comparator `{comparator}`")
 
     def translate_dref(value: int):
         if comparator == "equal":
@@ -114,12 +124,73 @@ DREF_TRANSLATORS = {
 
 def get_translator(function_string: str, translators=PRESS_TRANSLATORS):
     parts = function_string.split(",")
-    translate_fn = translators[parts[0]]
-    if len(parts) > 1:
-        translator = translate_fn(*parts[1:])
-    else:
-        translator = translate_fn()
-    return translator
+    translate_fn = translators.get(parts[0])
+    if translate_fn is None:
+        raise ValueError(f"Unknown translator `{parts[0]}`")
+    try:
+        return translate_fn(*parts[1:])
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid translator `{function_string}`: {e}")
+
+
+def compile_translators(key: "DeckKeyMapping"):
+    """Resolve a key's translator specs into callables"""
+    if key.translate_dataref:
+        key.translate_dataref = get_translator(
+            key.translate_dataref, translators=DREF_TRANSLATORS
+        )
+    if key.translate_secondary_dataref:
+        key.translate_secondary_dataref = get_translator(
+            key.translate_secondary_dataref, translators=DREF_TRANSLATORS
+        )
+    key.translate_press = (
+        get_translator(key.translate_press) if key.translate_press else translate_press
+    )
+    if key.translate_command_press:
+        key.translate_command_press = get_translator(
+            key.translate_command_press, translators=COMMAND_TRANSLATORS
+        )
+
+
+def _freeze(value: any):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class RenderCache:
+    """LRU of native key images keyed on the logical key state
+
+    Keys whose translated state is unchanged reuse the same native image,
+    so neither rendering nor the deck write is repeated
+    """
+
+    def __init__(self, deck: Deck, maxsize: int = 256):
+        self._deck = deck
+        self._maxsize = maxsize
+        self._images: OrderedDict[tuple, bytes] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, key_type: str, key_options: dict[str, any], **state):
+        cache_key = (key_type, _freeze(key_options), _freeze(state))
+        image = self._images.get(cache_key)
+        if image is not None:
+            self._images.move_to_end(cache_key)
+            self.hits += 1
+            return image
+
+        self.misses += 1
+        image = self._deck.to_native(KEY_TYPES[key_type](**state, **key_options))
+        self._images[cache_key] = image
+        if len(self._images) > self._maxsize:
+            self._images.popitem(last=False)
+        return image
+
+    def clear(self):
+        self._images.clear()
 
 
 @dataclass
@@ -157,9 +228,11 @@ class Decks:
         self.load_mapping()
         self._deck = Deck()
         self._deck.key_change_callback = self._key_change_callback
+        self._render_cache = RenderCache(self._deck)
         self._fcu = FCU()
-        self._udp = REST(self.on_drefs_changed)
+        self._udp = REST()
         self._udp.set_subscribed_drefs(self.get_all_drefs() + self._fcu.get_drefs())
+        self._udp.listen_batch(self.on_drefs_changed, self.get_all_drefs())
         self._fcu.udp = self._udp
         self._current_deck = 0
         self._is_home = True
@@ -176,10 +249,16 @@ class Decks:
         self._mapping = []
         for deck in yaml_content:
             deck["keys"] = [DeckKeyMapping(**key) for key in deck["keys"]]
+            for key in deck["keys"]:
+                try:
+                    compile_translators(key)
+                except ValueError as e:
+                    raise ValueError(
+                        f"Deck `{deck['name']}` key {key.key_id}: {e}"
+                    ) from e
             self._mapping.append(DeckMapping(**deck))
 
     def on_drefs_changed(self, drefs: dict[str, any]):
-        self._fcu.on_drefs_changed(drefs)
         self.update_faults()
         if self._is_home:
             return
@@ -244,10 +323,6 @@ class Decks:
                             and deck_key.command_press_up
                             and deck_key.translate_command_press
                         ):
-                            translator = get_translator(
-                                deck_key.translate_command_press,
-                                translators=COMMAND_TRANSLATORS,
-                            )
 
                             async def up():
                                 await self._udp.execute_command(
@@ -259,15 +334,11 @@ class Decks:
                                     deck_key.command_press_down
                                 )
 
-                            translator(dref_value, up, down)
+                            deck_key.translate_command_press(dref_value, up, down)
                         else:
-                            translator = (
-                                get_translator(deck_key.translate_press)
-                                if deck_key.translate_press
-                                else translate_press
-                            )
                             await self._udp.set_dataref(
-                                deck_key.state_dataref, translator(dref_value)
+                                deck_key.state_dataref,
+                                deck_key.translate_press(dref_value),
                             )
 
     def update_deck(self):
@@ -277,10 +348,13 @@ class Decks:
                 icon_props = {}
                 if deck.icon:
                     icon_props = {"state": deck.icon, "state_font": "symbols"}
-                image = KEY_TYPES["text_button"](
-                    label=deck.name, notification=deck.has_fault, **icon_props
+                image = self._render_cache.render(
+                    "text_button",
+                    icon_props,
+                    label=deck.name,
+                    notification=deck.has_fault,
                 )
-                self._deck.update_key(deck.deck_id, image)
+                self._deck.update_key_native(deck.deck_id, image)
         else:
             mapping = self.get_current_deck()
             for key in mapping.keys:
@@ -294,14 +368,13 @@ class Decks:
                 has_fault = True
                 break
 
-        image = KEY_TYPES["text_button"](
-            label="",
+        image = self._render_cache.render(
+            "text_button",
+            {"label": "", "state_font": "symbols", "state_font_size": 1.5},
             state="\ue88a",
-            state_font="symbols",
-            state_font_size=1.5,
             notification=has_fault,
         )
-        self._deck.update_key(self._deck.key_count - 1, image)
+        self._deck.update_key_native(self._deck.key_count - 1, image)
 
     def key_for_dref_in_current_deck(self, dref: str):
         mapping = self.get_current_deck()
@@ -332,27 +405,25 @@ class Decks:
         mapping_key = self.get_mapping_key(key_id)
         state = self._udp.get_dref_value(mapping_key.state_dataref)
         if mapping_key.translate_dataref:
-            translator = get_translator(
-                mapping_key.translate_dataref, translators=DREF_TRANSLATORS
-            )
-            state = translator(state)
+            state = mapping_key.translate_dataref(state)
         secondary_dref = self._get_secondary_dref(mapping_key)
         secondary_state = {"secondary_state": secondary_dref} if secondary_dref else {}
-        image = KEY_TYPES[mapping_key.key_type](
-            state=state, **secondary_state, **mapping_key.key_options
+        image = self._render_cache.render(
+            mapping_key.key_type,
+            mapping_key.key_options,
+            state=state,
+            **secondary_state,
         )
-        self._deck.update_key(mapping_key.key_id, image)
+        self._deck.update_key_native(mapping_key.key_id, image)
 
     def _get_secondary_dref(self, mapping_key: DeckKeyMapping):
         if mapping_key.secondary_dataref:
             secondary_state = self._udp.get_dref_value(mapping_key.secondary_dataref)
 
             if mapping_key.translate_secondary_dataref:
-                translator = get_translator(
-                    mapping_key.translate_secondary_dataref,
-                    translators=DREF_TRANSLATORS,
+                secondary_state = mapping_key.translate_secondary_dataref(
+                    secondary_state
                 )
-                secondary_state = translator(secondary_state)
 
             return secondary_state
 
@@ -384,6 +455,7 @@ class Decks:
 def run():
     decks = Decks()
     loop = asyncio.get_event_loop()
+    decks._fcu.loop = loop
 
     async def local_run():
         await decks._udp._init()
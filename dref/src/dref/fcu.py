@@ -1,41 +1,268 @@
+import asyncio
+import functools
 import logging
 import select
 import socket
 import struct
 import time
 import threading
+from dataclasses import dataclass
 
 from .udp import UDP
 
 logger = logging.getLogger(__name__)
 
+# dataref, slot, discrete (mode values skip frame pacing)[, scale]
 FCU_DREFS = [
-    ["AirbusFBW/SPDmanaged", 1],
-    ["sim/cockpit2/autopilot/airspeed_dial_kts_mach,2", 2],
-    ["AirbusFBW/HDGmanaged", 3],
-    ["sim/cockpit/autopilot/heading_mag,0", 4],
-    ["AirbusFBW/ALTmanaged", 5],
-    ["AirbusFBW/VSdashed", 6],
-    ["sim/cockpit2/autopilot/altitude_dial_ft", 7],
-    ["sim/cockpit/autopilot/vertical_velocity", 8],
-    ["sim/cockpit/radios/com1_freq_hz", 9],
-    ["sim/cockpit/radios/com1_stdby_freq_hz", 10],
-    ["sim/cockpit/misc/barometer_setting", 11],
-    ["sim/flightmodel/controls/parkbrake,0", 12],
-    ["sim/aircraft/parts/acf_gear_deploy[0]", 13],
-    ["AirbusFBW/HDGTRKmode", 14],
-    ["sim/cockpit/autopilot/airspeed_is_mach", 15],
+    ["AirbusFBW/SPDmanaged", 1, True],
+    ["sim/cockpit2/autopilot/airspeed_dial_kts_mach,2", 2, False],
+    ["AirbusFBW/HDGmanaged", 3, True],
+    ["sim/cockpit/autopilot/heading_mag,0", 4, False],
+    ["AirbusFBW/ALTmanaged", 5, True],
+    ["AirbusFBW/VSdashed", 6, True],
+    ["sim/cockpit2/autopilot/altitude_dial_ft", 7, False],
+    ["sim/cockpit/autopilot/vertical_velocity", 8, False],
+    ["sim/cockpit/radios/com1_freq_hz", 9, False],
+    ["sim/cockpit/radios/com1_stdby_freq_hz", 10, False],
+    ["sim/cockpit/misc/barometer_setting", 11, False, 33.864],
+    ["sim/flightmodel/controls/parkbrake,0", 12, True],
+    ["sim/aircraft/parts/acf_gear_deploy[0]", 13, True],
+    ["AirbusFBW/HDGTRKmode", 14, True],
+    ["sim/cockpit/autopilot/airspeed_is_mach", 15, True],
 ]
 
+# Panel controls, modelled on the XMidiCtrl mapping types: `enc` encoders
+# stepping a dataref or sending up / down commands, `pnp` push / pull and
+# `cmd` buttons. Encoder ticks are aggregated into one write per frame
+FCU_INPUTS = {
+    1: {
+        "type": "enc",
+        "command_up": "sim/autopilot/airspeed_up",
+        "command_down": "sim/autopilot/airspeed_down",
+    },
+    2: {
+        "type": "enc",
+        "dataref": "sim/cockpit/autopilot/heading_mag,0",
+        "step": 1,
+        "wrap": 360,
+    },
+    3: {
+        "type": "enc",
+        "dataref": "sim/cockpit2/autopilot/altitude_dial_ft",
+        "step": 100,
+    },
+    4: {
+        "type": "enc",
+        "command_up": "sim/autopilot/vertical_speed_up",
+        "command_down": "sim/autopilot/vertical_speed_down",
+    },
+    5: {
+        "type": "enc",
+        "command_up": "sim/instruments/barometer_up",
+        "command_down": "sim/instruments/barometer_down",
+    },
+    10: {
+        "type": "pnp",
+        "command_push": "AirbusFBW/PushSPDSel",
+        "command_pull": "AirbusFBW/PullSPDSel",
+    },
+    11: {
+        "type": "pnp",
+        "command_push": "AirbusFBW/PushHDGSel",
+        "command_pull": "AirbusFBW/PullHDGSel",
+    },
+    12: {
+        "type": "pnp",
+        "command_push": "AirbusFBW/PushAltitude",
+        "command_pull": "AirbusFBW/PullAltitude",
+    },
+    13: {
+        "type": "pnp",
+        "command_push": "AirbusFBW/PushVSSel",
+        "command_pull": "AirbusFBW/PullVSSel",
+    },
+    14: {
+        "type": "pnp",
+        "command_push": "toliss_airbus/capt_baro_push",
+        "command_pull": "toliss_airbus/capt_baro_pull",
+    },
+}
+
+RREF_HEADER = b"RREF,"
+RREF_VALUE = struct.Struct("<if")
+
+# v2 framing, see fcu/includes/xplane.hpp
+RRF2_HEADER = struct.Struct("<4sHBB")
+RRF2_VALUE = struct.Struct("<Bf")
+RRF2_KEYFRAME = 0x01
+
+# Panel input: header followed by `<Bh>` control id / value pairs. Encoders
+# send signed ticks, push / pull buttons > 0 push and < 0 pull
+INPUT_HEADER = b"INPT"
+INPUT_VALUE = struct.Struct("<Bh")
+
+# Minimum seconds between keyframes sent in answer to NACKs
+NACK_INTERVAL = 0.25
+
+# Prefer our own last write over the cached value until X-Plane echoes it
+WRITE_HOLD = 1.0
+
+
+def parse_hello(data: bytes):
+    """Parse `HELLO[,<port>][,v2]`
+
+    Returns the protocol version and the port the panel listens on, `None`
+    when not given
+    """
+    fields = data.strip().split(b",")
+    version = 1
+    if fields[-1] == b"v2":
+        version = 2
+        fields = fields[:-1]
+
+    port = None
+    if len(fields) > 1 and fields[-1].isdigit():
+        port = int(fields[-1])
+        if not 0 < port < 65536:
+            logger.warning(f"Ignoring invalid HELLO port {port}")
+            port = None
+    return version, port
+
+
+@dataclass
+class FCUSlot:
+    slot: int
+    discrete: bool = False
+    scale: float = 1.0
+
+
+def compile_drefs(drefs: list[list]):
+    """Compile `FCU_DREFS` style entries into a dref -> slot table"""
+    return {dref[0]: FCUSlot(*dref[1:]) for dref in drefs}
+
+
+@dataclass
+class FCUInput:
+    type: str
+    dataref: str = None
+    step: float = 1.0
+    wrap: float = None
+    command: str = None
+    command_up: str = None
+    command_down: str = None
+    command_push: str = None
+    command_pull: str = None
+
+
+INPUT_REQUIRED = {
+    "cmd": [["command"]],
+    "pnp": [["command_push", "command_pull"]],
+    "enc": [["dataref"], ["command_up", "command_down"]],
+}
+
+
+def compile_inputs(inputs: dict[int, dict]):
+    """Compile `FCU_INPUTS` style mappings into a control id -> input table"""
+    compiled = {}
+    for control, mapping in inputs.items():
+        try:
+            entry = FCUInput(**mapping)
+        except TypeError as e:
+            raise ValueError(f"Invalid input {control}: {e}")
+
+        required = INPUT_REQUIRED.get(entry.type)
+        if required is None:
+            raise ValueError(f"Invalid input {control}: unknown type `{entry.type}`")
+        if not any(all(getattr(entry, key) for key in keys) for keys in required):
+            raise ValueError(
+                f"Invalid input {control}: `{entry.type}` needs {required}"
+            )
+        compiled[control] = entry
+    return compiled
+
+
+class Endpoint:
+    """A panel, the datarefs it displays and its protocol state"""
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        drefs: list[list] = FCU_DREFS,
+        inputs: dict[int, dict] = FCU_INPUTS,
+    ):
+        self.address = address
+        self.slots = compile_drefs(drefs)
+        self.inputs = compile_inputs(inputs)
+        self.discrete = {dref for dref, slot in self.slots.items() if slot.discrete}
+        self.lock = threading.Lock()
+
+        self.version = 1
+        self.sequence = 0
+        self.last_keyframe = 0
+
+        self.pending: set[str] = set()
+        self.last_flush = 0
+
+        # Encoder ticks accumulated since the last frame
+        self.ticks: dict[int, int] = {}
+        self.last_input_flush = 0
+        # Last written dataref values and when
+        self.written: dict[str, tuple[float, float]] = {}
+
+        self.out = bytearray(
+            max(len(RREF_HEADER), RRF2_HEADER.size)
+            + max(RREF_VALUE.size, RRF2_VALUE.size) * len(self.slots)
+        )
+        self.out_view = memoryview(self.out)
+
+    @property
+    def drefs(self):
+        return list(self.slots.keys())
+
+    def set_version(self, version: int):
+        # v2 packs slots as uint8
+        if version == 2 and any(not 0 <= s.slot <= 255 for s in self.slots.values()):
+            logger.warning(f"Endpoint {self.address[0]} slots exceed uint8, using v1")
+            version = 1
+        self.version = version
+
 
 class FCU:
-    def __init__(self, ip: str = "192.168.1.199", port: int = 55678):
+    """Relays datarefs to a registry of ESP panels
+
+    All panels share one non-blocking socket and listen thread. Panels are
+    registered up front or when they send HELLO from a new IP, and keyed by
+    IP as the HELLO source port is arbitrary. Values are sent to `port`, or
+    the port the panel names in HELLO.
+    """
+
+    def __init__(
+        self,
+        endpoints: list[tuple[str, int]] = None,
+        port: int = 55678,
+        bind_ip: str = "",
+        keyframe_interval: float = 2.0,
+        frame_interval: float = 0.04,
+        loop: asyncio.AbstractEventLoop = None,
+    ):
         self._udp: UDP = None
-        self._esp_ip = ip
-        self._esp_port = port
+        # Event loop of an asyncio (REST, AsyncUDP) client, writes run on it
+        self.loop = loop
+        self._port = port
+        self._bind_ip = bind_ip
+        self._keyframe_interval = keyframe_interval
+        # Changes are sent at most once per frame, discrete ones immediately
+        self._frame_interval = frame_interval
+
+        self._lock = threading.Lock()
+        self._endpoints: dict[str, Endpoint] = {}
+        if endpoints is None:
+            endpoints = [("192.168.1.199", port)]
+        for address in endpoints:
+            self.add_endpoint(address)
 
-        self._esp_sock_lock = threading.Lock()
         self._esp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._esp_sock.setblocking(False)
 
         self._running = True
         self.listen_thread = threading.Thread(target=self.listen_esp_task)
@@ -43,7 +270,56 @@ class FCU:
         self.listen_thread.start()
 
     def get_drefs(self):
-        return [dref[0] for dref in FCU_DREFS]
+        with self._lock:
+            endpoints = list(self._endpoints.values())
+        return list(dict.fromkeys(d for e in endpoints for d in e.drefs))
+
+    @property
+    def endpoints(self):
+        with self._lock:
+            return list(self._endpoints.values())
+
+    def add_endpoint(
+        self,
+        address: tuple[str, int],
+        drefs: list[list] = FCU_DREFS,
+        inputs: dict[int, dict] = FCU_INPUTS,
+    ):
+        with self._lock:
+            if address[0] in self._endpoints:
+                raise ValueError(f"FCU endpoint {address[0]} already registered")
+        endpoint = Endpoint(address, drefs, inputs)
+        if self._udp:
+            self._listen(endpoint)
+        with self._lock:
+            self._endpoints[address[0]] = endpoint
+        logger.info(f"FCU endpoint {address[0]}:{address[1]}")
+        return endpoint
+
+    def _listen(self, endpoint: Endpoint):
+        """Subscribe and listen to the datarefs of `endpoint`
+
+        REST can only subscribe when it connects, so endpoints needing new
+        datarefs are rejected there. The client is updated through `_call`,
+        on its loop for asyncio clients
+        """
+        subscribed = self._udp.subscribed_drefs
+        missing = [dref for dref in endpoint.drefs if dref not in subscribed]
+        if missing and not hasattr(self._udp, "update_subscriptions"):
+            raise ValueError(
+                f"FCU endpoint datarefs not subscribed: {', '.join(missing)}"
+            )
+        self._call(self._subscribe, endpoint)
+
+    def _subscribe(self, endpoint: Endpoint):
+        with self._lock:
+            subscribed = self._udp.subscribed_drefs
+            missing = [dref for dref in endpoint.drefs if dref not in subscribed]
+            if missing:
+                self._udp.update_subscriptions(subscribed + missing)
+        self._udp.listen_batch(
+            functools.partial(self.on_drefs_changed, endpoint), endpoint.drefs
+        )
 
     @property
     def udp(self):
@@ -52,73 +328,279 @@ class FCU:
     @udp.setter
     def udp(self, value: UDP):
         self._udp = value
+        for endpoint in self.endpoints:
+            self._listen(endpoint)
 
     def close(self):
-        with self._esp_sock_lock:
-            self._running = False
-
+        self._running = False
         self.listen_thread.join()
 
-    def on_drefs_changed(self, drefs: dict[str, any]):
-        self.send_drefs(drefs.keys())
+    def on_drefs_changed(self, endpoint: Endpoint, drefs: dict[str, any]):
+        with endpoint.lock:
+            endpoint.pending.update(drefs.keys())
+            if (
+                time.monotonic() - endpoint.last_flush >= self._frame_interval
+                or not endpoint.discrete.isdisjoint(drefs)
+            ):
+                self._flush(endpoint)
+
+    def _flush(self, endpoint: Endpoint):
+        pending = endpoint.pending
+        endpoint.pending = set()
+        endpoint.last_flush = time.monotonic()
+        if pending:
+            self.send_drefs(endpoint, pending)
 
-    def find_dref(self, dref: str):
-        for fcu_dref in FCU_DREFS:
-            if dref == fcu_dref[0]:
-                return fcu_dref
+    def send_drefs(self, endpoint: Endpoint, drefs, keyframe: bool = False):
+        if endpoint.version == 2:
+            header, value_struct = RRF2_HEADER.size, RRF2_VALUE
+        else:
+            header, value_struct = len(RREF_HEADER), RREF_VALUE
 
-    def send_drefs(self, drefs):
-        msg = b"RREF,"
+        offset = header
         for dref in drefs:
-            dref_details = self.find_dref(dref)
-            if dref_details:
-                value = self._udp.get_dref_value(dref)
-                if value is not None:
-                    if dref == "sim/cockpit/misc/barometer_setting":
-                        value *= 33.864
-                    print("Sending", dref, value)
-                    msg += struct.pack("<if", dref_details[1], value)
+            slot = endpoint.slots.get(dref)
+            if slot is None:
+                continue
+            value = self._udp.get_dref_value(dref)
+            if value is None:
+                continue
+            value_struct.pack_into(endpoint.out, offset, slot.slot, value * slot.scale)
+            offset += value_struct.size
+
+        count = (offset - header) // value_struct.size
+        if endpoint.version == 2:
+            # Keyframes are sent even when empty to resync the sequence
+            if not count and not keyframe:
+                return
+            self._pack_v2_header(endpoint, count, keyframe)
+        else:
+            if not count:
+                return
+            endpoint.out[:header] = RREF_HEADER
+
         try:
-            self._esp_sock.sendto(msg, (self._esp_ip, self._esp_port))
-        except Exception:
-            logger.error("Could not send data to esp")
+            self._esp_sock.sendto(endpoint.out_view[:offset], endpoint.address)
+        except OSError:
+            logger.error(f"Could not send data to esp {endpoint.address[0]}")
+
+    def _pack_v2_header(self, endpoint: Endpoint, count: int, keyframe: bool):
+        flags = RRF2_KEYFRAME if keyframe else 0
+        if keyframe:
+            endpoint.last_keyframe = time.monotonic()
+        RRF2_HEADER.pack_into(endpoint.out, 0, b"RRF2", endpoint.sequence, flags, count)
+        endpoint.sequence = (endpoint.sequence + 1) & 0xFFFF
+
+    def refresh_all(self, endpoint: Endpoint):
+        logger.debug(f"Refreshing all drefs {endpoint.address[0]}")
+        with endpoint.lock:
+            endpoint.pending = set()
+            endpoint.last_flush = time.monotonic()
+            self.send_drefs(endpoint, endpoint.drefs, keyframe=True)
+
+    def _esp_received(self, data: bytes, address: tuple[str, int]):
+        with self._lock:
+            endpoint = self._endpoints.get(address[0])
+
+        if data.startswith(b"HELLO"):
+            version, port = parse_hello(data)
+            if not endpoint:
+                try:
+                    endpoint = self.add_endpoint((address[0], port or self._port))
+                except ValueError as e:
+                    logger.warning(f"Rejected FCU panel {address[0]}: {e}")
+                    return
+            with endpoint.lock:
+                if port:
+                    endpoint.address = (address[0], port)
+                endpoint.set_version(version)
+                endpoint.sequence = 0
+        elif data.startswith(b"NACK"):
+            if (
+                not endpoint
+                or time.monotonic() - endpoint.last_keyframe < NACK_INTERVAL
+            ):
+                return
+            logger.info(f"NACK {address[0]} {data[5:]}")
+        elif data.startswith(INPUT_HEADER):
+            if endpoint and self._udp:
+                self._input_received(endpoint, data)
+            return
+
+        if endpoint and self._udp:
+            logger.info(f"Refreshing all drefs {address[0]}")
+            self.refresh_all(endpoint)
+
+    def _input_received(self, endpoint: Endpoint, data: bytes):
+        commands = []
+        body = memoryview(data)[len(INPUT_HEADER) :]
+        body = body[: len(body) - len(body) % INPUT_VALUE.size]
+        for control, value in INPUT_VALUE.iter_unpack(body):
+            entry = endpoint.inputs.get(control)
+            if entry is None or not value:
+                continue
+            if entry.type == "enc":
+                with endpoint.lock:
+                    endpoint.ticks[control] = endpoint.ticks.get(control, 0) + value
+            elif entry.type == "pnp":
+                commands.append(entry.command_push if value > 0 else entry.command_pull)
+            elif value > 0:
+                commands.append(entry.command)
+
+        if commands:
+            self._execute_commands(commands)
+
+    def _flush_inputs(self, endpoint: Endpoint):
+        with endpoint.lock:
+            ticks = endpoint.ticks
+            endpoint.ticks = {}
+
+        commands = []
+        for control, count in ticks.items():
+            if not count:
+                continue
+            entry = endpoint.inputs[control]
+            if entry.dataref:
+                self._step_dref(endpoint, entry, count)
+            else:
+                command = entry.command_up if count > 0 else entry.command_down
+                commands.extend([command] * abs(count))
 
-    def refresh_all(self):
-        logger.info("Refreshing all drefs")
-        self.send_drefs(self.get_drefs())
+        if commands:
+            self._execute_commands(commands)
+
+    def _step_dref(self, endpoint: Endpoint, entry: FCUInput, count: int):
+        now = time.monotonic()
+        value, written = endpoint.written.get(entry.dataref, (None, 0))
+        if now - written > WRITE_HOLD:
+            value = self._udp.get_dref_value(entry.dataref)
+        if value is None:
+            return
+
+        value += count * entry.step
+        if entry.wrap:
+            value %= entry.wrap
+        endpoint.written[entry.dataref] = (value, now)
+        self._write_dref(entry.dataref.split(",")[0], value)
+
+    def _write_dref(self, dref: str, value: float):
+        # UDP clients queue writes with set_dref, REST awaits set_dataref
+        if hasattr(self._udp, "set_dref"):
+            self._call(self._udp.set_dref, dref, value)
+        else:
+            self._run_async(self._udp.set_dataref(dref, value))
+
+    def _execute_commands(self, commands: list[str]):
+        if asyncio.iscoroutinefunction(self._udp.execute_command):
+            self._run_async(self._execute_commands_async(commands))
+        else:
+            for command in commands:
+                self._call(self._udp.execute_command, command)
+
+    def _call(self, method: callable, *args):
+        # asyncio clients are not thread safe, call them on their loop
+        if self.loop:
+            self.loop.call_soon_threadsafe(method, *args)
+        else:
+            method(*args)
+
+    def _run_async(self, coro):
+        if not self.loop:
+            coro.close()
+            logger.warning("No event loop for the REST client, dropped FCU input")
+            return
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        future.add_done_callback(self._async_done)
+
+    @staticmethod
+    def _async_done(future):
+        if not future.cancelled() and future.exception():
+            logger.error(f"FCU input failed: {future.exception()!r}")
+
+    async def _execute_commands_async(self, commands: list[str]):
+        for command in commands:
+            await self._udp.execute_command(command)
+
+    def _service_endpoints(self):
+        """Flush inputs, changes and keyframes that are due
+
+        Returns the seconds until the next one is due, at most one frame as
+        changes are queued from the client thread without waking the loop
+        """
+        now = time.monotonic()
+        wait = self._frame_interval
+        for endpoint in self.endpoints:
+            if endpoint.ticks and self._udp:
+                due = endpoint.last_input_flush + self._frame_interval - now
+                if due <= 0:
+                    endpoint.last_input_flush = now
+                    self._flush_inputs(endpoint)
+                else:
+                    wait = min(wait, due)
+            if endpoint.pending:
+                due = endpoint.last_flush + self._frame_interval - now
+                if due <= 0:
+                    with endpoint.lock:
+                        self._flush(endpoint)
+                else:
+                    wait = min(wait, due)
+            if endpoint.version == 2 and self._udp:
+                due = endpoint.last_keyframe + self._keyframe_interval - now
+                if due < 0:
+                    self.refresh_all(endpoint)
+                else:
+                    wait = min(wait, due)
+        return wait
+
+    def _bind(self):
+        while self._running:
+            try:
+                self._esp_sock.bind((self._bind_ip, self._port))
+                return True
+            except OSError as e:
+                logger.error(f"Could not bind fcu port {self._port}: {str(e)}")
+                time.sleep(5)
 
     def listen_esp_task(self):
+        if not self._bind():
+            return
+
+        timeout = self._frame_interval
         while self._running:
+            ready_to_read, _, _ = select.select([self._esp_sock], [], [], timeout)
+            while ready_to_read:
+                try:
+                    data, address = self._esp_sock.recvfrom(2048)
+                except BlockingIOError:
+                    break
+                except OSError as e:
+                    logger.error(f"Could not read from fcu: {str(e)}")
+                    break
+
+                logger.debug("ESP: %s %s", data, address)
+                if not data:
+                    continue
+                try:
+                    self._esp_received(data, address)
+                except Exception:
+                    # One bad datagram must not stop the panel thread
+                    logger.exception(f"Error handling fcu datagram from {address[0]}")
+
             try:
-                hostname = socket.gethostname()
-                ip_addr = socket.gethostbyname(hostname)
-                self._esp_sock.bind((ip_addr, self._esp_port))
-
-                while self._running:
-                    ready_to_read, _, _ = select.select([self._esp_sock], [], [], 1)
-                    if ready_to_read:
-                        data1, addr1 = ready_to_read[0].recvfrom(2048)
-                        logger.info("ESP: %s %s", data1, addr1)
-                        if data1:
-                            with self._esp_sock_lock:
-                                self.refresh_all()
-                    else:
-                        time.sleep(1)
-            except Exception as e:
-                logger.exception(f"Could not listen to fcu: {str(e)}")
+                timeout = self._service_endpoints()
+            except Exception:
+                logger.exception("Error servicing fcu endpoints")
+                timeout = self._frame_interval
                 time.sleep(1)
 
+        self._esp_sock.close()
         logger.info("listen task ended")
 
 
 if __name__ == "__main__":
     try:
-
-        def on_dref_changed(drefs: dict[str, any]):
-            fcu.on_drefs_changed(drefs)
-
         fcu = FCU()
-        udp = UDP(drefs=fcu.get_drefs(), on_drefs_changed=on_dref_changed)
+        udp = UDP(drefs=fcu.get_drefs(), on_drefs_changed=None)
         fcu.udp = udp
 
         while 1:
@@ -0,0 +1,214 @@
+import argparse
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+from .udp import MCAST_GRP, MCAST_PORT, UDP, parse_beacon
+
+""" Record and replay X-Plane UDP datagrams
+
+    Recordings are append only: a `XPREC1` header followed by
+    `<dH` (seconds since the recorder started, length) and the raw datagram.
+    BECN beacons and RREF packets are stored as received.
+"""
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"XPREC1"
+RECORD_HEADER = struct.Struct("<dH")
+
+
+class Recorder:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "ab")
+        if new_file:
+            self._file.write(MAGIC)
+        self._start = time.monotonic()
+        self.count = 0
+
+    def record(self, data: bytes):
+        header = RECORD_HEADER.pack(time.monotonic() - self._start, len(data))
+        with self._lock:
+            self._file.write(header)
+            self._file.write(data)
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_recording(path: str):
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a datagram recording")
+
+        while True:
+            header = file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            timestamp, length = RECORD_HEADER.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                return
+            yield timestamp, data
+
+
+class Replayer:
+    """Replay a recording as if it came from X-Plane
+
+    Recorded beacons are rewritten to point at the replayer's own socket and
+    sent to the multicast group, RREF packets go to the first client that
+    subscribes, or to `target` directly. Without a target replay pauses at
+    the first RREF until a client subscribes, for up to `client_timeout`
+    seconds. `speed` is a multiplier, `0` replays as fast as possible. RREF indexes are replayed as recorded so the client
+    must subscribe to the same dataref list in the same order.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        target: tuple[str, int] = None,
+        speed: float = 1.0,
+        bind_ip: str = "0.0.0.0",
+        client_timeout: float = 30.0,
+    ):
+        self._path = path
+        self._target = target
+        self._speed = speed
+        self._client_timeout = client_timeout
+        self._beacon: bytes = None
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((bind_ip, 0))
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self.sent = 0
+        self.bytes = 0
+
+    @property
+    def port(self):
+        return self._sock.getsockname()[1]
+
+    def _wait_for_client(self, timeout: float):
+        """Wait for a client RREF subscription, repeating the last beacon"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            self._sock.settimeout(min(remaining, 1.0) if remaining > 0 else 0)
+            try:
+                data, addr = self._sock.recvfrom(2048)
+            except (BlockingIOError, socket.timeout):
+                if remaining <= 0:
+                    return
+                if self._beacon:
+                    self._sock.sendto(self._beacon, (MCAST_GRP, MCAST_PORT))
+                continue
+            if data[:4] == b"RREF":
+                logger.info(f"Client subscribed from {addr[0]}:{addr[1]}")
+                self._target = addr
+                return
+
+    def _send_beacon(self, packet: bytes):
+        if not parse_beacon(packet, ("", 0)):
+            return
+        self._beacon = packet[:19] + struct.pack("<H", self.port) + packet[21:]
+        self._sock.sendto(self._beacon, (MCAST_GRP, MCAST_PORT))
+
+    def run(self):
+        start = time.monotonic()
+        offset = None
+        last_timestamp = 0
+        for timestamp, data in read_recording(self._path):
+            # Appended sessions restart their clock
+            if offset is None or timestamp < last_timestamp:
+                offset = timestamp - (time.monotonic() - start) * (self._speed or 1)
+            last_timestamp = timestamp
+
+            if self._speed:
+                delay = (timestamp - offset) / self._speed - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+
+            if data[:4] == b"BECN":
+                self._send_beacon(data)
+                continue
+
+            if not self._target:
+                logger.info("Waiting for a client to subscribe")
+                self._wait_for_client(self._client_timeout)
+                if not self._target:
+                    logger.warning(
+                        f"No client subscribed within {self._client_timeout}s"
+                    )
+                    break
+                # Resume the replay clock from this record
+                offset = timestamp - (time.monotonic() - start) * (self._speed or 1)
+
+            self._sock.sendto(data, self._target)
+            self.sent += 1
+            self.bytes += len(data)
+
+        elapsed = time.monotonic() - start
+        logger.info(
+            f"Replayed {self.sent} packets, {self.bytes} bytes in {elapsed:.2f}s "
+            f"({self.sent / elapsed if elapsed else 0:.0f} packets/s)"
+        )
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    record_parser = subparsers.add_parser("record")
+    record_parser.add_argument("path")
+    record_parser.add_argument("drefs", nargs="*")
+    record_parser.add_argument("--drefs-file", type=str)
+
+    replay_parser = subparsers.add_parser("replay")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("--speed", type=float, default=1.0)
+    replay_parser.add_argument("--target", type=str, help="host:port")
+    replay_parser.add_argument(
+        "--client-timeout",
+        type=float,
+        default=30.0,
+        help="Seconds to wait for a client to subscribe without --target",
+    )
+
+    args = parser.parse_args()
+
+    if args.mode == "replay":
+        target = None
+        if args.target:
+            host, port = args.target.split(":")
+            target = (host, int(port))
+        Replayer(
+            args.path,
+            target=target,
+            speed=args.speed,
+            client_timeout=args.client_timeout,
+        ).run()
+        return
+
+    drefs = list(args.drefs)
+    if args.drefs_file:
+        with open(args.drefs_file) as file:
+            drefs.extend(line.strip() for line in file if line.strip())
+
+    recorder = Recorder(args.path)
+    udp = UDP(drefs, on_drefs_changed=None, recorder=recorder)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        udp.close()
+        recorder.close()
+        logger.info(f"Recorded {recorder.count} datagrams to {args.path}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,226 @@
+import argparse
+import logging
+import math
+import select
+import socket
+import struct
+import time
+import zlib
+
+from .udp import MCAST_GRP, MCAST_PORT
+
+""" Minimal X-Plane UDP stand-in for load testing
+
+    Sends BECN beacons, accepts RREF subscriptions and streams synthetic
+    values at the requested rates, DREF and CMND writes are logged and DREF
+    values are held so they are echoed back to subscribers.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Keep packets well within the 2048 byte receive buffers of the clients
+MAX_VALUES_PER_PACKET = 128
+
+
+def beacon_packet(port: int, hostname: str = "dref-sim", version: int = 121400):
+    return (
+        b"BECN\x00"
+        + struct.pack("<BBiiIH", 1, 2, 1, version, 1, port)
+        + hostname.encode("utf-8")
+        + b"\x00"
+        + struct.pack("<H", port + 10)
+    )
+
+
+class SyntheticValue:
+    def __init__(self, name: str):
+        seed = zlib.crc32(name.encode("utf-8"))
+        self.base = seed % 1000
+        self.amplitude = (seed >> 10) % 50
+        self.omega = 2 * math.pi / (5 + (seed >> 16) % 60)
+        self.held = None
+
+    def value(self, now: float):
+        if self.held is not None:
+            return self.held
+        return self.base + self.amplitude * math.sin(self.omega * now)
+
+
+class RateGroup:
+    """RREF indexes a client subscribed at the same rate"""
+
+    def __init__(self, freq: int, now: float):
+        self.interval = 1 / freq
+        self.next_due = now
+        self.indexes: dict[int, SyntheticValue] = {}
+
+
+class SimServer:
+    def __init__(
+        self,
+        bind_ip: str = "0.0.0.0",
+        port: int = 49000,
+        hostname: str = "dref-sim",
+        beacon_interval: float = 1.0,
+    ):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Subscribing thousands of datarefs arrives as one burst of RREFs
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self._sock.bind((bind_ip, port))
+        self._sock.setblocking(False)
+        self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self._beacon = beacon_packet(self.port, hostname)
+        self._beacon_interval = beacon_interval
+        self._next_beacon = 0
+
+        self._values: dict[str, SyntheticValue] = {}
+        # client address -> freq -> group
+        self._clients: dict[tuple[str, int], dict[int, RateGroup]] = {}
+        self._running = True
+
+        self.packets = 0
+        self.writes = 0
+        self.commands = 0
+
+    @property
+    def port(self):
+        return self._sock.getsockname()[1]
+
+    @property
+    def subscriptions(self):
+        return sum(
+            len(group.indexes)
+            for groups in self._clients.values()
+            for group in groups.values()
+        )
+
+    def _synthetic(self, name: str):
+        value = self._values.get(name)
+        if value is None:
+            value = self._values[name] = SyntheticValue(name)
+        return value
+
+    def _subscribe(self, addr: tuple[str, int], freq: int, index: int, name: str):
+        groups = self._clients.setdefault(addr, {})
+        for group_freq, group in list(groups.items()):
+            group.indexes.pop(index, None)
+            if not group.indexes:
+                del groups[group_freq]
+
+        if freq > 0:
+            group = groups.get(freq)
+            if group is None:
+                group = groups[freq] = RateGroup(freq, time.monotonic())
+            group.indexes[index] = self._synthetic(name)
+
+        if not groups:
+            del self._clients[addr]
+
+    def handle(self, data: bytes, addr: tuple[str, int]):
+        header = data[:4]
+        if header == b"RREF":
+            freq, index, name = struct.unpack("<ii400s", data[5:413])
+            name = name.split(b"\x00")[0].decode("utf-8")
+            logger.debug(f"RREF {addr[0]}:{addr[1]} {index} {name} @{freq}")
+            self._subscribe(addr, freq, index, name)
+        elif header == b"DREF":
+            value, name = struct.unpack("<f500s", data[5:509])
+            name = name.split(b"\x00")[0].decode("utf-8")
+            logger.info(f"DREF {name} = {value}")
+            self._synthetic(name).held = value
+            self.writes += 1
+        elif header == b"CMND":
+            command = data[5:].split(b"\x00")[0].decode("utf-8")
+            logger.info(f"CMND {command}")
+            self.commands += 1
+        else:
+            logger.warning(f"Unknown packet {header} from {addr[0]}")
+
+    def _send_group(self, addr: tuple[str, int], group: RateGroup, now: float):
+        items = list(group.indexes.items())
+        for start in range(0, len(items), MAX_VALUES_PER_PACKET):
+            chunk = items[start : start + MAX_VALUES_PER_PACKET]
+            values = []
+            for index, value in chunk:
+                values.append(index)
+                values.append(value.value(now))
+            packet = b"RREF," + struct.pack("<" + "if" * len(chunk), *values)
+            try:
+                self._sock.sendto(packet, addr)
+            except BlockingIOError:
+                continue
+            except OSError as e:
+                logger.warning(f"Could not send to {addr[0]}:{addr[1]} {str(e)}")
+                return
+            self.packets += 1
+
+    def tick(self):
+        now = time.monotonic()
+        if now >= self._next_beacon:
+            self._sock.sendto(self._beacon, (MCAST_GRP, MCAST_PORT))
+            self._next_beacon = now + self._beacon_interval
+
+        next_due = self._next_beacon
+        for addr, groups in self._clients.items():
+            for group in groups.values():
+                if now >= group.next_due:
+                    self._send_group(addr, group, now)
+                    group.next_due += group.interval
+                    # Don't try to catch up after a stall
+                    if group.next_due < now:
+                        group.next_due = now + group.interval
+                next_due = min(next_due, group.next_due)
+        return next_due
+
+    def serve_forever(self, stats_interval: float = 10.0):
+        next_stats = time.monotonic() + stats_interval
+        last_packets = 0
+        while self._running:
+            timeout = max(0, self.tick() - time.monotonic())
+            ready_to_read, _, _ = select.select([self._sock], [], [], timeout)
+            while ready_to_read:
+                try:
+                    data, addr = self._sock.recvfrom(2048)
+                except BlockingIOError:
+                    break
+                self.handle(data, addr)
+
+            now = time.monotonic()
+            if now >= next_stats:
+                logger.info(
+                    f"{len(self._clients)} clients, {self.subscriptions} subscriptions, "
+                    f"{(self.packets - last_packets) / stats_interval:.0f} packets/s"
+                )
+                last_packets = self.packets
+                next_stats = now + stats_interval
+
+    def close(self):
+        self._running = False
+        self._sock.close()
+
+
+def run():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bind-ip", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=49000)
+    parser.add_argument("--hostname", type=str, default="dref-sim")
+    parser.add_argument("--beacon-interval", type=float, default=1.0)
+    parser.add_argument("--stats-interval", type=float, default=10.0)
+    args = parser.parse_args()
+
+    server = SimServer(
+        bind_ip=args.bind_ip,
+        port=args.port,
+        hostname=args.hostname,
+        beacon_interval=args.beacon_interval,
+    )
+    logger.info(f"X-Plane stand-in listening on {args.bind_ip}:{server.port}")
+    try:
+        server.serve_forever(stats_interval=args.stats_interval)
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == "__main__":
+    run()
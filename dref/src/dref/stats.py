@@ -0,0 +1,103 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Buckets keep 6 significant bits, i.e. better than 1.6% relative error
+SUB_BUCKET_BITS = 6
+
+
+class Histogram:
+    """HDR style log-linear histogram of integer values (nanoseconds)"""
+
+    def __init__(self):
+        self._counts: dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def _bucket(value: int):
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        if shift <= 0:
+            return value
+        return (shift << SUB_BUCKET_BITS) + (value >> shift)
+
+    @staticmethod
+    def _bucket_value(bucket: int):
+        shift = bucket >> SUB_BUCKET_BITS
+        if shift == 0:
+            return bucket
+        mantissa = bucket & ((1 << SUB_BUCKET_BITS) - 1)
+        # Midpoint of the bucket range
+        return (mantissa << shift) + (1 << (shift - 1))
+
+    def record(self, value: int):
+        value = max(0, int(value))
+        bucket = self._bucket(value)
+        self._counts[bucket] = self._counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percentile: float):
+        if not self.count:
+            return None
+        target = self.count * percentile / 100
+        seen = 0
+        for bucket in sorted(self._counts.keys()):
+            seen += self._counts[bucket]
+            if seen >= target:
+                return min(self._bucket_value(bucket), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def reset(self):
+        self.__init__()
+
+
+class LatencyStats:
+    """Per stage latency histograms, values are recorded in nanoseconds"""
+
+    def __init__(self, stages: list[str]):
+        self._histograms = {stage: Histogram() for stage in stages}
+
+    def record(self, stage: str, value: int):
+        self._histograms[stage].record(value)
+
+    def summary(self):
+        """p50/p99/max per stage in microseconds"""
+        summary = {}
+        for stage, histogram in self._histograms.items():
+            if not histogram.count:
+                continue
+            summary[stage] = {
+                "count": histogram.count,
+                "p50": histogram.percentile(50) / 1000,
+                "p99": histogram.percentile(99) / 1000,
+                "max": histogram.max / 1000,
+            }
+        return summary
+
+    def log(self, reset: bool = False):
+        summary = self.summary()
+        if summary:
+            logger.info(
+                "Latency us "
+                + " ".join(
+                    f"{stage}: p50={values['p50']:.0f} p99={values['p99']:.0f} max={values['max']:.0f} n={values['count']}"
+                    for stage, values in summary.items()
+                )
+            )
+        if reset:
+            self.reset()
+
+    def reset(self):
+        for histogram in self._histograms.values():
+            histogram.reset()
@@ -1,4 +1,6 @@
 import binascii
+import contextlib
+import heapq
 import platform
 import logging
 import select
@@ -7,6 +9,15 @@ import struct
 import time
 import threading
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from plan.drefs import DrefEntry, DrefFilter, DrefListeners, parse_dref
+
+from .stats import LatencyStats
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
@@ -15,10 +26,11 @@ class XPlaneIpNotFound(Exception):
     args = "Could not find any running X Plane instance on the network."
 
 
-def find_xp(wait: float = 3.0):
-    MCAST_GRP = "239.255.1.1"
-    MCAST_PORT = 49707
+MCAST_GRP = "239.255.1.1"
+MCAST_PORT = 49707
+
 
+def beacon_socket():
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     if platform.system() == "Windows":
@@ -27,71 +39,816 @@ def find_xp(wait: float = 3.0):
         sock.bind((MCAST_GRP, MCAST_PORT))
     mreq = struct.pack("=4sl", socket.inet_aton(MCAST_GRP), socket.INADDR_ANY)
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    return sock
+
+
+def parse_beacon(packet: bytes, sender: tuple[str, int]):
+    header = packet[0:5]
+    if header != b"BECN\x00":
+        logging.info("Unknown packet from " + sender[0])
+        logging.info(str(len(packet)) + " bytes")
+        logging.info(packet)
+        logging.info(binascii.hexlify(packet))
+        return
+
+    data = packet[5:21]
+    (
+        beacon_major_version,
+        beacon_minor_version,
+        application_host_id,
+        xplane_version_number,
+        role,
+        port,
+    ) = struct.unpack("<BBiiIH", data)
+
+    computer_name = packet[21:]
+    computer_name = computer_name.split(b"\x00")[0]
+    (raknet_port,) = struct.unpack("<H", packet[-2:])
+
+    if all(
+        [
+            beacon_major_version == 1,
+            beacon_minor_version == 2,
+            application_host_id == 1,
+        ]
+    ):
+        return {
+            "ip": sender[0],
+            "port": port,
+            "hostname": computer_name.decode("utf-8"),
+            "xplane_version": xplane_version_number,
+            "role": role,
+            "raknet_port": raknet_port,
+        }
+
 
+def find_xp(wait: float = 3.0):
+    sock = beacon_socket()
     if wait > 0:
         sock.settimeout(wait)
 
     beacon_data = {}
-    while not beacon_data:
-        try:
+    try:
+        while not beacon_data:
             packet, sender = sock.recvfrom(15000)
-            header = packet[0:5]
-            if header != b"BECN\x00":
-                logging.info("Unknown packet from " + sender[0])
-                logging.info(str(len(packet)) + " bytes")
-                logging.info(packet)
-                logging.info(binascii.hexlify(packet))
+            beacon_data = parse_beacon(packet, sender)
+    except socket.timeout:
+        raise XPlaneIpNotFound()
+    finally:
+        sock.close()
 
-            else:
-                data = packet[5:21]
-                (
-                    beacon_major_version,
-                    beacon_minor_version,
-                    application_host_id,
-                    xplane_version_number,
-                    role,
-                    port,
-                ) = struct.unpack("<BBiiIH", data)
-
-                computer_name = packet[21:]
-                computer_name = computer_name.split(b"\x00")[0]
-                (raknet_port,) = struct.unpack("<H", packet[-2:])
-
-                if all(
-                    [
-                        beacon_major_version == 1,
-                        beacon_minor_version == 2,
-                        application_host_id == 1,
-                    ]
-                ):
-                    beacon_data = {
-                        "ip": sender[0],
-                        "port": port,
-                        "hostname": computer_name.decode("utf-8"),
-                        "xplane_version": xplane_version_number,
-                        "role": role,
-                        "raknet_port": raknet_port,
-                    }
-
-        except socket.timeout:
-            raise XPlaneIpNotFound()
-
-    sock.close()
     return beacon_data
 
 
-class UDP:
-    def __init__(self, drefs: list[str], on_drefs_changed: callable):
+class BeaconListener:
+    """Tracks the X-Plane beacon from a long lived multicast socket
+
+    `on_change` is called with the new beacon on a new host, port or version,
+    and with `None` once no beacon has been seen for `timeout` seconds
+    """
+
+    def __init__(self, on_change: callable, timeout: float = 3.0):
+        self._on_change = on_change
+        self._timeout = timeout
+        self._beacon = None
+        self._last_seen = 0
+
+    @property
+    def beacon(self):
+        return self._beacon
+
+    @property
+    def last_seen(self):
+        return self._last_seen
+
+    @property
+    def address(self):
+        if self._beacon:
+            return (self._beacon["ip"], self._beacon["port"])
+        return ()
+
+    def process(self, packet: bytes, sender: tuple[str, int]):
+        beacon = parse_beacon(packet, sender)
+        if not beacon:
+            return
+
+        self._last_seen = time.monotonic()
+        current = self._beacon
+        self._beacon = beacon
+        if (
+            current is None
+            or current["ip"] != beacon["ip"]
+            or current["port"] != beacon["port"]
+            or current["xplane_version"] != beacon["xplane_version"]
+        ):
+            logger.info(
+                f"Beacon available {beacon['hostname']} {beacon['ip']}:{beacon['port']}"
+            )
+            self._on_change(beacon)
+
+    def check(self):
+        if self._beacon and time.monotonic() - self._last_seen > self._timeout:
+            logger.info("X-Plane not found")
+            self._beacon = None
+            self._on_change(None)
+
+
+def rref_request(interval: int, index: int, dref: str):
+    return struct.pack("<4sxii400s", b"RREF", interval, index, dref.encode("utf-8"))
+
+
+def dref_request(dref: str, value: float):
+    return struct.pack("<4sxf500s", b"DREF", value, dref.encode("utf-8"))
+
+
+def cmnd_request(command: str):
+    return struct.pack("<4sx500s", b"CMND", command.encode("utf-8"))
+
+
+def data_select_request(groups: list[int], enable: bool = True):
+    header = b"DSEL" if enable else b"USEL"
+    return struct.pack(f"<4sx{len(groups)}i", header, *groups)
+
+
+class WriteQueue:
+    """Outgoing DREF and CMND writes
+
+    A DREF write replaces the pending value of the same dataref, commands
+    keep their order and writes are never moved across a command
+    """
+
+    def __init__(self):
+        self._queue: list[list] = []
+        self._pending: dict[str, list] = {}
+        self.sent = 0
+        self.merged = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put_dref(self, dref: str, value: float):
+        pending = self._pending.get(dref)
+        if pending:
+            pending[2] = value
+            self.merged += 1
+            return
+
+        item = [b"DREF", dref, value]
+        self._pending[dref] = item
+        self._queue.append(item)
+
+    def put_command(self, command: str):
+        self._queue.append([b"CMND", command, None])
+        self._pending = {}
+
+    def drain(self):
+        queue = self._queue
+        self._queue = []
+        self._pending = {}
+        self.sent += len(queue)
+        return [
+            dref_request(name, value) if kind == b"DREF" else cmnd_request(name)
+            for kind, name, value in queue
+        ]
+
+    @property
+    def stats(self):
+        return {"sent": self.sent, "merged": self.merged}
+
+
+LATENCY_STAGES = ["decode", "diff", "callback", "total"]
+
+# Not available on Windows, fall back to polling with select
+RECV_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+
+RREF_DTYPE = np.dtype([("index", "<i4"), ("value", "<f4")]) if np else None
+
+
+class DrefTable:
+    """Subscribed datarefs compiled into a table addressed by RREF index
+
+    With `use_numpy` packets are viewed in place as a structured array and
+    rounding, scatter and change detection are vectorised. Entries without
+    an explicit `@rate` are subscribed at `rate`.
+
+    Array slices take a contiguous range of slots, their value is a numpy
+    array and changes are reported as a boolean mask of the changed elements.
+
+    `filters` maps dataref keys to a `DrefFilter`, filtered values are rounded
+    by the filter so it can see the raw value
+    """
+
+    def __init__(
+        self,
+        drefs: list[str],
+        use_numpy: bool = False,
+        rate: int = 5,
+        filters: dict[str, DrefFilter] = None,
+    ):
+        self._rate = rate
+        self._filters = filters or {}
+        self._use_numpy = use_numpy
+        if use_numpy and np is None:
+            raise RuntimeError("numpy is required for the numpy RREF decoder")
+
+        self.values: dict[str, any] = {}
+        self.entries: list[DrefEntry | None] = []
+        self.slots: dict[str, int] = {}
+        self._free_slots: list[int] = []
+        for key in dict.fromkeys(drefs):
+            self._add(key)
+
+        if use_numpy:
+            self._compile_arrays()
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _parse(self, key: str):
+        entry = parse_dref(key)
+        if entry.length and np is None:
+            raise RuntimeError(f"numpy is required for dataref slice `{key}`")
+        if entry.rate is None:
+            entry.rate = self._rate
+        entry.filter = self._filters.get(key)
+        if entry.filter and entry.length:
+            raise ValueError(f"Filters are not supported on dataref slice `{key}`")
+        return entry
+
+    def _add(self, key: str):
+        entry = self._parse(key)
+        if entry.length is None and self._free_slots:
+            entry.slot = heapq.heappop(self._free_slots)
+        else:
+            entry.slot = len(self.entries)
+            self.entries.extend([None] * (entry.length or 1))
+
+        for slot in entry.slot_range:
+            self.entries[slot] = entry
+        self.slots[key] = entry.slot
+        self.values[key] = (
+            None if entry.length is None else np.full(entry.length, np.nan)
+        )
+        return entry
+
+    def _remove(self, key: str):
+        slot = self.slots.pop(key)
+        entry = self.entries[slot]
+        for slot in entry.slot_range:
+            self.entries[slot] = None
+            heapq.heappush(self._free_slots, slot)
+        del self.values[key]
+        return entry
+
+    def _compile_arrays(self):
+        entries = self.entries
+        array = np.full(len(entries), np.nan)
+        for key, slot in self.slots.items():
+            entry = entries[slot]
+            value = self.values[key]
+            if entry.length is None:
+                if value is not None:
+                    array[slot] = value
+            else:
+                array[entry.slot_range.start : entry.slot_range.stop] = value
+        self._array = array
+
+        # Slices are views into the value array
+        for key, slot in self.slots.items():
+            entry = entries[slot]
+            if entry.length is not None:
+                self.values[key] = array[entry.slot_range.start : entry.slot_range.stop]
+
+        self._active = np.array([entry is not None for entry in entries], dtype=bool)
+        self._scale = np.array([entry.scale if entry else 1.0 for entry in entries])
+        self._filtered = np.array(
+            [bool(entry and entry.filter) for entry in entries], dtype=bool
+        )
+        self._rounded = np.array(
+            [
+                bool(entry and entry.precision is not None and not entry.filter)
+                for entry in entries
+            ],
+            dtype=bool,
+        )
+        self._factor = np.array(
+            [10.0 ** (entry.precision or 0) if entry else 1.0 for entry in entries]
+        )
+
+    def update(self, drefs: list[str]):
+        """Diff the table against a new dataref set
+
+        Slots of removed datarefs are reused by added ones, lowest first,
+        returns `(added, removed)` lists of `(slot, entry)`
+        """
+        drefs = dict.fromkeys(drefs)
+        removed = []
+        for key in list(self.slots.keys()):
+            if key not in drefs:
+                entry = self._remove(key)
+                removed.extend((slot, entry) for slot in entry.slot_range)
+
+        added = []
+        for key in drefs:
+            if key not in self.slots:
+                entry = self._add(key)
+                added.extend((slot, entry) for slot in entry.slot_range)
+
+        if self._use_numpy and (added or removed):
+            self._compile_arrays()
+
+        return added, removed
+
+    def decode(self, payload: bytes):
+        return self.diff(self.decode_values(payload))
+
+    def decode_values(self, payload: bytes):
+        """Unpack, scale and round an RREF payload without touching the table"""
+        if self._use_numpy:
+            return self._decode_values_numpy(payload)
+
+        entries = self.entries
+        decoded = []
+        size = len(entries)
+        for index, value in struct.iter_unpack("<if", payload):
+            # Negative indexes would wrap around to the last slots
+            if not 0 <= index < size:
+                continue
+            entry = entries[index]
+            if entry is None:
+                continue
+            if entry.scale != 1.0:
+                value *= entry.scale
+            if entry.precision is not None and entry.filter is None:
+                value = round(value, entry.precision)
+            decoded.append((entry, index, value))
+
+        return decoded
+
+    def diff(self, decoded):
+        """Store decoded values, returns the ones that changed"""
+        if self._use_numpy:
+            return self._diff_numpy(*decoded)
+
+        values = self.values
+        changed = {}
+        for entry, slot, value in decoded:
+            key = entry.key
+            if entry.filter is not None:
+                value = entry.filter.apply(entry, value, values[key])
+                if value is not None:
+                    values[key] = value
+                    changed[key] = value
+                continue
+
+            if entry.length is None:
+                if value != values[key]:
+                    values[key] = value
+                    changed[key] = value
+                continue
+
+            array = values[key]
+            offset = slot - entry.slot
+            if value != array[offset]:
+                array[offset] = value
+                mask = changed.get(key)
+                if mask is None:
+                    mask = changed[key] = np.zeros(entry.length, dtype=bool)
+                mask[offset] = True
+
+        return changed
+
+    def _decode_values_numpy(self, payload: bytes):
+        records = np.frombuffer(
+            payload, dtype=RREF_DTYPE, count=len(payload) // RREF_DTYPE.itemsize
+        )
+        indexes = records["index"]
+        values = records["value"]
+        valid = (indexes >= 0) & (indexes < len(self.entries))
+        valid[valid] = self._active[indexes[valid]]
+        if not valid.all():
+            indexes = indexes[valid]
+            values = values[valid]
+
+        values = values * self._scale[indexes]
+        factor = self._factor[indexes]
+        values = np.where(
+            self._rounded[indexes], np.round(values * factor) / factor, values
+        )
+        return indexes, values
+
+    def _diff_numpy(self, indexes, values):
+        changed_mask = values != self._array[indexes]
+        if not changed_mask.any():
+            return {}
+
+        indexes = indexes[changed_mask]
+        values = values[changed_mask]
+        plain = ~self._filtered[indexes]
+        self._array[indexes[plain]] = values[plain]
+
+        entries = self.entries
+        changed = {}
+        for index, value in zip(indexes.tolist(), values.tolist()):
+            entry = entries[index]
+            key = entry.key
+            if entry.filter is not None:
+                value = entry.filter.apply(entry, value, self.values[key])
+                if value is not None:
+                    self._array[index] = value
+                    self.values[key] = value
+                    changed[key] = value
+                continue
+
+            if entry.length is None:
+                self.values[key] = value
+                changed[key] = value
+                continue
+
+            mask = changed.get(key)
+            if mask is None:
+                mask = changed[key] = np.zeros(entry.length, dtype=bool)
+            mask[index - entry.slot] = True
+
+        return changed
+
+
+# Named fields of the X-Plane DATA output groups, unused values are `None`
+DATA_FIELDS = {
+    3: [
+        "vind_kias",
+        "vind_keas",
+        "vtrue_ktas",
+        "vtrue_ktgs",
+        None,
+        "vind_mph",
+        "vtrue_mphas",
+        "vtrue_mphgs",
+    ],
+    4: [
+        "mach",
+        None,
+        "vvi_fpm",
+        None,
+        "gload_normal",
+        "gload_axial",
+        "gload_side",
+        None,
+    ],
+    17: ["pitch", "roll", "heading_true", "heading_mag", None, None, None, None],
+    20: [
+        "latitude",
+        "longitude",
+        "altitude_msl",
+        "altitude_agl",
+        "on_runway",
+        "altitude_ind",
+        "latitude_south",
+        "longitude_west",
+    ],
+}
+
+DATA_DTYPE = np.dtype([("group", "<i4"), ("values", "<f4", (8,))]) if np else None
+
+
+class DataGroups:
+    """Decode X-Plane DATA output packets into `data/<field>` values
+
+    Values are stored in `values`, normally the same dict as the RREF table
+    so both are read through `get_dref_value`
+    """
+
+    def __init__(self, groups: list[int], values: dict[str, any]):
+        if np is None:
+            raise RuntimeError("numpy is required for DATA output groups")
+        unknown = [group for group in groups if group not in DATA_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown DATA output groups {unknown}")
+
+        self.groups = list(groups)
+        self.values = values
+        self._rows = np.full(max(DATA_FIELDS.keys()) + 1, -1)
+        self._keys = []
+        for row, group in enumerate(self.groups):
+            self._rows[group] = row
+            self._keys.append(
+                [f"data/{field}" if field else None for field in DATA_FIELDS[group]]
+            )
+            for key in self._keys[-1]:
+                if key:
+                    self.values[key] = None
+        self._named = np.array(
+            [[key is not None for key in keys] for keys in self._keys]
+        )
+        self._matrix = np.full((len(self.groups), 8), np.nan, dtype=np.float32)
+
+    def decode(self, payload: bytes):
+        records = np.frombuffer(
+            payload, dtype=DATA_DTYPE, count=len(payload) // DATA_DTYPE.itemsize
+        )
+        groups = records["group"]
+        valid = (groups >= 0) & (groups < len(self._rows))
+        rows = np.full(len(groups), -1)
+        rows[valid] = self._rows[groups[valid]]
+        valid = rows >= 0
+        rows = rows[valid]
+        values = records["values"][valid]
+
+        changed_mask = (values != self._matrix[rows]) & self._named[rows]
+        self._matrix[rows] = values
+
+        changed = {}
+        for record, field in zip(*np.nonzero(changed_mask)):
+            key = self._keys[rows[record]][field]
+            value = float(values[record, field])
+            self.values[key] = value
+            changed[key] = value
+        return changed
+
+
+def merge_changes(merged: dict[str, any], changed: dict[str, any]):
+    for key, value in changed.items():
+        current = merged.get(key)
+        if current is not None and np is not None and isinstance(value, np.ndarray):
+            current |= value
+        else:
+            merged[key] = value
+
+
+class AdaptiveRate:
+    """Raise the RREF rate of datarefs while they are changing
+
+    A dataref that changes is resubscribed at `rate` and dropped back to its
+    own rate after `hold` seconds without a change
+    """
+
+    def __init__(self, table: DrefTable, rate: int, hold: float = 2.0):
+        self._table = table
+        self._rate = rate
+        self._hold = hold
+        self._boosted: dict[int, float] = {}
+        self._settle_until = 0
+
+    def reset(self):
+        # Every value changes from `None` right after subscribing
+        self._boosted = {}
+        self._settle_until = time.monotonic() + self._hold
+
+    def on_changed(self, changed: dict[str, any]):
+        now = time.monotonic()
+        if now < self._settle_until:
+            return []
+
+        boost = []
+        for key in changed:
+            slot = self._table.slots.get(key)
+            if slot is None:
+                continue
+            entry = self._table.entries[slot]
+            if entry.rate >= self._rate:
+                continue
+            if slot not in self._boosted:
+                boost.extend(
+                    (element, entry, self._rate) for element in entry.slot_range
+                )
+            self._boosted[slot] = now
+        return boost
+
+    def expire(self):
+        now = time.monotonic()
+        drop = []
+        for slot, last_changed in list(self._boosted.items()):
+            if now - last_changed > self._hold:
+                entry = self._table.entries[slot]
+                if entry is not None:
+                    drop.extend(
+                        (element, entry, entry.rate) for element in entry.slot_range
+                    )
+                del self._boosted[slot]
+        return drop
+
+
+class DrefClient:
+    """Transport independent core shared by `UDP` and `AsyncUDP`
+
+    Owns the dataref table, listeners, subscriptions, decode / diff and
+    latency stats. Subclasses provide `_send` and how it is scheduled.
+    """
+
+    def __init__(
+        self,
+        drefs: list[str],
+        on_drefs_changed: callable = None,
+        use_numpy: bool = False,
+        write_window: float = 0.02,
+        rate: int = 5,
+        adaptive_rate: int = None,
+        adaptive_hold: float = 2.0,
+        recorder=None,
+        latency_stats: bool = False,
+        stats_interval: float = 10.0,
+        data_groups: list[int] = None,
+        filters: dict[str, DrefFilter] = None,
+    ):
+        # Guards the table, a no-op unless the subclass is threaded
+        self._table_lock = contextlib.nullcontext()
+        self._xplane_address = ()
+        self._beacon = BeaconListener(self._on_beacon_changed)
+
+        self._dref_table = DrefTable(
+            drefs, use_numpy=use_numpy, rate=rate, filters=filters
+        )
+        self._dref_buffer = self._dref_table.values
+        self._data_groups = (
+            DataGroups(data_groups, self._dref_buffer) if data_groups else None
+        )
+        self._listeners = DrefListeners()
+        if on_drefs_changed:
+            self._listeners.listen_batch(on_drefs_changed)
+        self._recorder = recorder
+        self._latency = LatencyStats(LATENCY_STAGES) if latency_stats else None
+        self._stats_interval = stats_interval
+        self._next_stats = time.monotonic() + stats_interval
+        self._adaptive_rate = (
+            AdaptiveRate(self._dref_table, adaptive_rate, adaptive_hold)
+            if adaptive_rate
+            else None
+        )
+
+        self._write_window = write_window
+        self._write_queue = WriteQueue()
+
+    def _send(self, msg: bytes):
+        raise NotImplementedError
+
+    def _on_beacon_changed(self, beacon: dict[str, any] | None):
+        raise NotImplementedError
+
+    def _can_resubscribe(self):
+        return bool(self._xplane_address)
+
+    @property
+    def beacon(self):
+        return self._beacon
+
+    def get_dref_value(self, dref: str | list[str]):
+        if isinstance(dref, list):
+            return [self._dref_buffer.get(d) for d in dref]
+        return self._dref_buffer.get(dref)
+
+    @property
+    def subscribed_drefs(self):
+        with self._table_lock:
+            return list(self._dref_table.slots)
+
+    def latency_stats(self):
+        if self._latency:
+            return self._latency.summary()
+
+    def listen(self, dref: str, callback: callable):
+        self._listeners.listen(dref, callback)
+
+    def unlisten(self, dref: str, callback: callable):
+        self._listeners.unlisten(dref, callback)
+
+    def listen_batch(self, callback: callable, drefs: list[str] = None):
+        self._listeners.listen_batch(callback, drefs)
+
+    def _subscribe(self, interval: int = None):
+        if self._adaptive_rate:
+            self._adaptive_rate.reset()
+        self._resubscribe(
+            (
+                (dref_id, entry, entry.rate if interval is None else interval)
+                for dref_id, entry in enumerate(self._dref_table.entries)
+                if entry is not None
+            )
+        )
+        if self._data_groups:
+            self._send(data_select_request(self._data_groups.groups, interval != 0))
+
+    def update_subscriptions(self, drefs: list[str]):
+        with self._table_lock:
+            added, removed = self._dref_table.update(drefs)
+        logger.info(f"Subscriptions: {len(added)} added, {len(removed)} removed")
+        if self._can_resubscribe():
+            self._resubscribe(
+                [(slot, entry, 0) for slot, entry in removed]
+                + [(slot, entry, entry.rate) for slot, entry in added]
+            )
+
+    def _resubscribe(self, subscriptions):
+        for dref_id, entry, interval in subscriptions:
+            self._send(rref_request(interval, dref_id, entry.rref_at(dref_id)))
+
+    def _expire_adaptive(self):
+        if self._adaptive_rate and self._xplane_address:
+            self._resubscribe(self._adaptive_rate.expire())
+
+    def _log_latency(self):
+        if self._latency and time.monotonic() >= self._next_stats:
+            self._latency.log(reset=True)
+            self._next_stats = time.monotonic() + self._stats_interval
+
+    def _decode(self, data: bytes | memoryview):
+        """Decode an RREF or DATA packet
+
+        Returns the changed values and decode / diff times in ns, which are
+        only measured when latency stats are enabled
+        """
+        header = data[:4]
+        if header == b"RREF":
+            if not self._latency:
+                with self._table_lock:
+                    return self._dref_table.decode(data[5:]), 0, 0
+
+            with self._table_lock:
+                start = time.perf_counter_ns()
+                decoded = self._dref_table.decode_values(data[5:])
+                decode_end = time.perf_counter_ns()
+                changed = self._dref_table.diff(decoded)
+                diff_end = time.perf_counter_ns()
+            return changed, decode_end - start, diff_end - decode_end
+        if header == b"DATA" and self._data_groups:
+            return self._data_groups.decode(data[5:]), 0, 0
+        return {}, 0, 0
+
+    def _datagram_received(self, data: bytes | memoryview, received: int):
+        if self._recorder:
+            self._recorder.record(bytes(data))
+        changed, decode_time, diff_time = self._decode(data)
+        self._dispatch(changed, received, decode_time, diff_time)
+
+    def _dispatch(
+        self,
+        changed: dict[str, any],
+        received: int,
+        decode_time: int = 0,
+        diff_time: int = 0,
+    ):
+        callback_start = time.perf_counter_ns()
+        if changed:
+            if self._adaptive_rate:
+                self._resubscribe(self._adaptive_rate.on_changed(changed))
+            self._listeners.dispatch(changed)
+
+        if self._latency:
+            end = time.perf_counter_ns()
+            self._latency.record("decode", decode_time)
+            self._latency.record("diff", diff_time)
+            if changed:
+                self._latency.record("callback", end - callback_start)
+            self._latency.record("total", end - received)
+
+
+class UDP(DrefClient):
+    def __init__(
+        self,
+        drefs: list[str],
+        on_drefs_changed: callable,
+        use_numpy: bool = False,
+        write_window: float = 0.02,
+        rate: int = 5,
+        adaptive_rate: int = None,
+        adaptive_hold: float = 2.0,
+        recorder=None,
+        latency_stats: bool = False,
+        stats_interval: float = 10.0,
+        drain: bool = False,
+        rcvbuf: int = None,
+        data_groups: list[int] = None,
+        data_port: int = None,
+        filters: dict[str, DrefFilter] = None,
+    ):
+        super().__init__(
+            drefs,
+            on_drefs_changed,
+            use_numpy=use_numpy,
+            write_window=write_window,
+            rate=rate,
+            adaptive_rate=adaptive_rate,
+            adaptive_hold=adaptive_hold,
+            recorder=recorder,
+            latency_stats=latency_stats,
+            stats_interval=stats_interval,
+            data_groups=data_groups,
+            filters=filters,
+        )
         self._state_lock = threading.Lock()
+        self._table_lock = threading.Lock()
         self._xplane_socket_lock = threading.Lock()
         self._xplane_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if rcvbuf:
+            self._xplane_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        if data_port:
+            # X-Plane sends DATA output to the address set in its network settings
+            self._xplane_socket.bind(("0.0.0.0", data_port))
+        self._recv_buffer = bytearray(65536) if drain else None
 
-        self._xplane_address = []
         self._running = True
         self._should_subscribe = True
-
-        self._dref_buffer = {key: None for key in drefs}
-        self._on_drefs_changed = on_drefs_changed
+        self._subscribe_event = threading.Event()
+        self._write_condition = threading.Condition()
 
         self.beacon_thread = threading.Thread(target=self.beacon_task)
         self.beacon_thread.daemon = True
@@ -101,26 +858,31 @@ class UDP:
         self.subscribe_thread.daemon = True
         self.subscribe_thread.start()
 
-        self.parse_thread = threading.Thread(target=self.parse_datarefs_task)
+        self.parse_thread = threading.Thread(
+            target=self.drain_datarefs_task if drain else self.parse_datarefs_task
+        )
         self.parse_thread.daemon = True
         self.parse_thread.start()
 
+        self.send_thread = threading.Thread(target=self.send_task)
+        self.send_thread.daemon = True
+        self.send_thread.start()
+
     def close(self):
         with self._state_lock:
             self._running = False
+        self._subscribe_event.set()
+        with self._write_condition:
+            self._write_condition.notify()
 
         logger.info("joining threads")
         self.beacon_thread.join()
         self.subscribe_thread.join()
         self.parse_thread.join()
+        self.send_thread.join()
 
         self._subscribe(0)
 
-    def get_dref_value(self, dref: str | list[str]):
-        if isinstance(dref, list):
-            return [self._dref_buffer.get(d) for d in dref]
-        return self._dref_buffer.get(dref)
-
     @property
     def lock(self):
         return self._state_lock
@@ -134,40 +896,50 @@ class UDP:
         with self._state_lock:
             return self._running
 
+    def _on_beacon_changed(self, beacon: dict[str, any] | None):
+        with self._state_lock:
+            self._should_subscribe = True
+            self._xplane_address = (beacon["ip"], beacon["port"]) if beacon else ()
+        self._subscribe_event.set()
+
     def beacon_task(self):
+        sock = None
         while self.running:
             logger.debug("Beacon thread running")
-            try:
-                beacon = find_xp()
-                with self._state_lock:
-                    if not self._xplane_address:
-                        logger.info("Baacon available")
-                    self._xplane_address = (beacon["ip"], beacon["port"])
-
-            except XPlaneIpNotFound:
-                logger.info("X-Plane not found")
-                with self.lock:
-                    if not self._should_subscribe:
-                        self._should_subscribe = True
-                        self._xplane_address = ()
-            time.sleep(1)
+            if sock is None:
+                try:
+                    sock = beacon_socket()
+                except OSError as e:
+                    logger.warning(f"Could not open beacon socket {str(e)}")
+                    time.sleep(1)
+                    continue
+
+            ready_to_read, _, _ = select.select([sock], [], [], 1)
+            if ready_to_read:
+                packet, sender = sock.recvfrom(15000)
+                if self._recorder:
+                    self._recorder.record(packet)
+                self._beacon.process(packet, sender)
+            self._beacon.check()
+
+        if sock:
+            sock.close()
         logger.info("beacon task ended")
 
-    def _subscribe(self, interval: int = 5):
+    def _send(self, msg: bytes):
         with self.socket_lock:
-            for dref_id, dref in enumerate(self._dref_buffer.keys()):
-                dref_and_opts = dref.split(",")
-                msg = struct.pack(
-                    "<4sxii400s",
-                    b"RREF",
-                    interval,
-                    dref_id,
-                    dref_and_opts[0].encode("utf-8"),
-                )
-                try:
-                    self._xplane_socket.sendto(msg, self._xplane_address)
-                except Exception as e:
-                    logger.warning(f"Could not subscribe to X-Plane datarefs {str(e)}")
+            try:
+                self._xplane_socket.sendto(msg, self._xplane_address)
+            except Exception as e:
+                logger.warning(f"Could not send to X-Plane {str(e)}")
+
+    def _can_resubscribe(self):
+        # Called with the state lock held
+        return bool(self._xplane_address) and not self._should_subscribe
+
+    def update_subscriptions(self, drefs: list[str]):
+        with self._state_lock:
+            super().update_subscriptions(drefs)
 
     def subscribe_task(self):
         while self.running:
@@ -177,49 +949,94 @@ class UDP:
                     logger.info("Subscribing to drefs")
                     self._subscribe()
                     self._should_subscribe = False
+                else:
+                    self._expire_adaptive()
 
-            time.sleep(1)
+            self._log_latency()
+            self._subscribe_event.wait(1)
+            self._subscribe_event.clear()
         logger.info("subscribe task ended")
 
     def parse_datarefs_task(self):
-        dref_lookup = list(self._dref_buffer.keys())
         while self.running:
             ready_to_read, _, _ = select.select([self._xplane_socket], [], [], 1)
             if ready_to_read:
                 data, addr = ready_to_read[0].recvfrom(2048)
-                header = data[:4]
-                if header == b"RREF":
-                    dref_bytes = data[5:]
-                    drefs = [list(v) for v in struct.iter_unpack("<if", dref_bytes)]
-                    changed = {}
-                    for dref in drefs:
-                        dref_key = dref_lookup[dref[0]]
-                        if dref_key in self._dref_buffer:
-                            dref_opts = dref_key.split(",")
-                            if len(dref_opts) > 1:
-                                dref[1] = round(dref[1], int(dref_opts[1]))
-                            if dref[1] != self._dref_buffer[dref_key]:
-                                changed[dref_key] = dref[1]
-                        else:
-                            changed[dref_key] = dref[1]
-                        self._dref_buffer[dref_key] = dref[1]
-
-                    if changed:
-                        if self._on_drefs_changed:
-                            self._on_drefs_changed(changed)
+                self._datagram_received(memoryview(data), time.perf_counter_ns())
+
+        logger.info("parse task ended")
+
+    def drain_datarefs_task(self):
+        """Read every queued datagram per wakeup and fire one merged callback"""
+        sock = self._xplane_socket
+        buffer = self._recv_buffer
+        view = memoryview(buffer)
+        while self.running:
+            ready_to_read, _, _ = select.select([sock], [], [], 1)
+            if not ready_to_read:
+                continue
+
+            received = time.perf_counter_ns()
+            decode_time = 0
+            diff_time = 0
+            merged = {}
+            while True:
+                try:
+                    nbytes = sock.recv_into(buffer, len(buffer), RECV_DONTWAIT)
+                except (BlockingIOError, InterruptedError):
+                    break
+                if self._recorder:
+                    self._recorder.record(bytes(view[:nbytes]))
+                changed, decode, diff = self._decode(view[:nbytes])
+                merge_changes(merged, changed)
+                decode_time += decode
+                diff_time += diff
+
+                if not RECV_DONTWAIT and not select.select([sock], [], [], 0)[0]:
+                    break
+
+            self._dispatch(merged, received, decode_time, diff_time)
 
         logger.info("parse task ended")
 
+    @property
+    def write_stats(self):
+        with self._write_condition:
+            return self._write_queue.stats
+
+    def send_task(self):
+        while self.running:
+            with self._write_condition:
+                if not self._write_queue:
+                    self._write_condition.wait(1)
+                    continue
+
+            # Let bursts of writes to the same dataref coalesce
+            time.sleep(self._write_window)
+            with self._write_condition:
+                messages = self._write_queue.drain()
+
+            with self._state_lock:
+                xplane_address = self._xplane_address
+            if not xplane_address:
+                logger.warning(f"X-Plane not available, dropped {len(messages)} writes")
+                continue
+
+            for msg in messages:
+                self._send(msg)
+
+        logger.info("send task ended")
+
     def set_dref(self, dref: str, value: any):
-        msg = struct.pack("<4sxf500s", b"DREF", value, dref.encode("utf-8"))
-        print("set dref", dref, value)
-        with self.socket_lock:
-            self._xplane_socket.sendto(msg, self._xplane_address)
+        logger.debug(f"set dref {dref} {value}")
+        with self._write_condition:
+            self._write_queue.put_dref(dref, value)
+            self._write_condition.notify()
 
     def execute_command(self, command: str):
-        msg = struct.pack("<4sx500s", b"CMND", command.encode("utf-8"))
-        with self.socket_lock:
-            self._xplane_socket.sendto(msg, self._xplane_address)
+        with self._write_condition:
+            self._write_queue.put_command(command)
+            self._write_condition.notify()
 
 
 if __name__ == "__main__":
@@ -237,8 +1054,7 @@ if __name__ == "__main__":
 
         # OHP Arrays
         # for i in [21, 30, 31, 34, 70, 24, 25, 26, 27, 28, 29, 32, 35, 49]:
-        #     for j in range(40):
-        #         drefs.append(f"AirbusFBW/OHPLightsATA{i}_Raw[{j}]")
+        #     drefs.append(f"AirbusFBW/OHPLightsATA{i}_Raw[0:40]")
 
         udp = UDP(drefs, on_dref_changed)
 
@@ -2,11 +2,15 @@ import argparse
 import binascii
 import platform
 import logging
-import select
+import selectors
 import socket
 import struct
 import time
-import threading
+import tomllib
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
 
 """ X Plane UDP DREF Subscriber / Forwarder
 
@@ -17,20 +21,27 @@ import threading
 
     From https://github.com/charlylima/XPlaneUDP/blob/master/XPlaneUdp.py
     and https://gitlab.bliesener.com/jbliesener/PiDisplay/-/blob/master/XPlaneUDP.py
+
+    Client protocol:
+    - v1: `RREF,` followed by `<if>` slot / value pairs
+    - v2 (`HELLO,v2`): `<4sHBB>` `RRF2`, uint16 sequence, flags (bit 0
+      keyframe), count, followed by `<Bf>` slot / value pairs. Keyframes
+      carry every known value and are sent on HELLO, periodically and in
+      response to `NACK,<sequence>` from a client that saw a gap.
 """
 
 logger = logging.getLogger("dref manager")
 logging.basicConfig(level=logging.INFO)
 
 
-class XPlaneIpNotFound(Exception):
-    args = "Could not find any running xplane instance in network."
+# Minimum seconds between keyframes sent in answer to NACKs
+NACK_INTERVAL = 0.25
 
+MCAST_GRP = "239.255.1.1"
+MCAST_PORT = 49707
 
-def find_xp(wait: float = 3.0):
-    MCAST_GRP = "239.255.1.1"
-    MCAST_PORT = 49707
 
+def beacon_socket():
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     if platform.system() == "Windows":
@@ -39,106 +50,508 @@ def find_xp(wait: float = 3.0):
         sock.bind((MCAST_GRP, MCAST_PORT))
     mreq = struct.pack("=4sl", socket.inet_aton(MCAST_GRP), socket.INADDR_ANY)
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
-
-    if wait > 0:
-        sock.settimeout(wait)
-
-    beacon_data = {}
-    while not beacon_data:
+    return sock
+
+
+def parse_beacon(packet: bytes, sender: tuple[str, int]):
+    header = packet[0:5]
+    if header != b"BECN\x00":
+        logger.debug(f"Unknown packet from {sender[0]}: {binascii.hexlify(packet)}")
+        return
+
+    data = packet[5:21]
+    (
+        beacon_major_version,
+        beacon_minor_version,
+        application_host_id,
+        xplane_version_number,
+        role,
+        port,
+    ) = struct.unpack("<BBiiIH", data)
+
+    computer_name = packet[21:]
+    computer_name = computer_name.split(b"\x00")[0]
+    (raknet_port,) = struct.unpack("<H", packet[-2:])
+
+    if all(
+        [
+            beacon_major_version == 1,
+            beacon_minor_version == 2,
+            application_host_id == 1,
+        ]
+    ):
+        return {
+            "ip": sender[0],
+            "port": port,
+            "hostname": computer_name.decode("utf-8"),
+            "xplane_version": xplane_version_number,
+            "role": role,
+            "raknet_port": raknet_port,
+        }
+
+
+PROFILES_PATH = Path(__file__).parent / "profiles"
+
+
+@dataclass
+class ProfileDref:
+    dataref: bytes
+    rate: int
+    slot: int
+    scale: float = 1.0
+    offset: float = 0.0
+    round: int | None = None
+    deadband: float = 0.0
+    discrete: bool = False
+
+
+def load_profiles(path: Path = PROFILES_PATH):
+    """Load `<aircraft>.toml` profiles from `path`"""
+    profiles: dict[str, list[ProfileDref]] = {}
+    for file in sorted(Path(path).glob("*.toml")):
+        with open(file, "rb") as fh:
+            profile = tomllib.load(fh)
+
+        drefs = []
+        for dref in profile.get("dref", []):
+            try:
+                drefs.append(
+                    ProfileDref(**{**dref, "dataref": dref["dataref"].encode()})
+                )
+            except (KeyError, TypeError) as e:
+                raise ValueError(f"Invalid dref {dref} in `{file}`: {e}")
+        profiles[file.stem] = drefs
+    return profiles
+
+
+def parse_hello(data: bytes, profiles: dict[str, list[ProfileDref]], default: str):
+    """Parse a client registration
+
+    `HELLO` registers the default aircraft, `HELLO,<aircraft>` a named one.
+    Following lines `<slot>,<dataref>[,<freq>]` register an explicit set.
+    The first line may end with the port the client listens on, otherwise
+    replies go to the relay port, and `,v2` to select the v2 framing, e.g.
+    `HELLO,citationx,55678,v2`.
+
+    Malformed lines are skipped, returns the drefs, protocol version and
+    reply port (`None` when not given)
+    """
+    lines = data.strip().split(b"\n")
+    header = lines[0].split(b",")
+    version = 1
+    if header[-1] == b"v2":
+        version = 2
+        header = header[:-1]
+
+    port = None
+    if len(header) > 1 and header[-1].isdigit():
+        port = int(header[-1])
+        header = header[:-1]
+        if not 0 < port < 65536:
+            logger.warning(f"Ignoring HELLO with invalid port {port}")
+            return [], version, None
+
+    drefs = []
+    malformed = False
+    for line in lines[1:]:
+        parts = line.strip().split(b",")
+        if len(parts) < 2:
+            continue
         try:
-            packet, sender = sock.recvfrom(15000)
-            header = packet[0:5]
-            if header != b"BECN\x00":
-                print("Unknown packet from " + sender[0])
-                print(str(len(packet)) + " bytes")
-                print(packet)
-                print(binascii.hexlify(packet))
-
-            else:
-                data = packet[5:21]
-                (
-                    beacon_major_version,
-                    beacon_minor_version,
-                    application_host_id,
-                    xplane_version_number,
-                    role,
-                    port,
-                ) = struct.unpack("<BBiiIH", data)
-
-                computer_name = packet[21:]
-                computer_name = computer_name.split(b"\x00")[0]
-                (raknet_port,) = struct.unpack("<H", packet[-2:])
-
-                if all(
-                    [
-                        beacon_major_version == 1,
-                        beacon_minor_version == 2,
-                        application_host_id == 1,
-                    ]
-                ):
-                    beacon_data = {
-                        "ip": sender[0],
-                        "port": port,
-                        "hostname": computer_name.decode("utf-8"),
-                        "xplane_version": xplane_version_number,
-                        "role": role,
-                        "raknet_port": raknet_port,
-                    }
-
-        except socket.timeout:
-            raise XPlaneIpNotFound()
-
-    sock.close()
-    return beacon_data
-
-
-DREFS = {
-    "citationx": [
-        [b"sim/cockpit2/autopilot/airspeed_mode", 2, 1],
-        [b"sim/cockpit2/autopilot/airspeed_dial_kts", 8, 2],
-        [b"sim/cockpit2/autopilot/heading_mode", 2, 3],
-        [b"sim/cockpit/autopilot/heading_mag", 8, 4],
-        [b"sim/cockpit2/autopilot/altitude_mode", 2, 5],
-        [b"sim/cockpit2/autopilot/vvi_status", 2, 6],
-        [b"sim/cockpit2/autopilot/altitude_dial_ft", 8, 7],
-        [b"sim/cockpit/autopilot/vertical_velocity", 8, 8],
-        [b"sim/cockpit/radios/nav1_freq_hz", 8, 9],
-        [b"sim/cockpit/radios/nav1_stdby_freq_hz", 8, 10],
-        [b"sim/cockpit/misc/barometer_setting", 8, 11],
-        [b"sim/flightmodel/controls/parkbrake", 2, 12],
-        [b"sim/aircraft/parts/acf_gear_deploy[0]", 2, 13],
-        [b"sim/cockpit2/autopilot/TOGA_status", 2, 14],
-    ],
-    "a320": [
-        [b"AirbusFBW/SPDmanaged", 2, 1],
-        [b"sim/cockpit2/autopilot/airspeed_dial_kts", 8, 2],
-        [b"AirbusFBW/HDGmanaged", 2, 3],
-        [b"sim/cockpit/autopilot/heading_mag", 8, 4],
-        [b"AirbusFBW/ALTmanaged", 2, 5],
-        [b"AirbusFBW/VSdashed", 2, 6],
-        [b"sim/cockpit2/autopilot/altitude_dial_ft", 8, 7],
-        [b"sim/cockpit/autopilot/vertical_velocity", 8, 8],
-        [b"sim/cockpit/radios/com1_freq_hz", 8, 9],
-        [b"sim/cockpit/radios/com1_stdby_freq_hz", 8, 10],
-        [b"sim/cockpit/misc/barometer_setting", 8, 11],
-        [b"sim/flightmodel/controls/parkbrake", 2, 12],
-        [b"sim/aircraft/parts/acf_gear_deploy[0]", 2, 13],
-        [b"sim/cockpit2/autopilot/TOGA_status", 2, 14],
-    ],
-}
-
-
-class ClientState:
-    def __init__(self):
-        self._lock = threading.Lock()
-        self.refresh_all = False
-        self.running = True
-        self.should_subscribe = True
-        self.xplane_address = []
+            freq = int(parts[2]) if len(parts) > 2 else 8
+            slot = int(parts[0])
+        except ValueError:
+            logger.warning(f"Ignoring malformed HELLO line {line!r}")
+            malformed = True
+            continue
+        drefs.append(ProfileDref(parts[1], freq, slot))
+
+    if malformed and not drefs:
+        return [], version, port
+    if not drefs:
+        try:
+            aircraft = header[1].decode("utf-8") if len(header) > 1 else default
+        except UnicodeDecodeError:
+            logger.warning(f"Ignoring malformed HELLO {lines[0]!r}")
+            return [], version, port
+        if aircraft not in profiles:
+            logger.warning(f"Unknown aircraft `{aircraft}`")
+            return [], version, port
+        drefs = profiles[aircraft]
+    return drefs, version, port
+
+
+class Client:
+    """A client's drefs compiled into slot-ordered transform arrays"""
+
+    def __init__(
+        self, address: tuple[str, int], drefs: list[ProfileDref], version: int = 1
+    ):
+        self.address = address
+        self.drefs = drefs
+        if version == 2 and any(dref.slot > 255 for dref in drefs):
+            logger.warning(f"Client {address[0]} slots exceed uint8, using v1")
+            version = 1
+        self.version = version
+        self.sequence = 0
+        self.last_keyframe = 0
+        self.last_flush = 0
+
+        self.slots = np.array([dref.slot for dref in drefs], dtype=np.int32)
+        self.scale = np.array([dref.scale for dref in drefs], dtype=np.float64)
+        self.offset = np.array([dref.offset for dref in drefs], dtype=np.float64)
+        self.rounded = np.array([dref.round is not None for dref in drefs])
+        self.round_factor = 10.0 ** np.array([dref.round or 0 for dref in drefs])
+        self.deadband = np.array([dref.deadband for dref in drefs], dtype=np.float64)
+        self.discrete = np.array([dref.discrete for dref in drefs])
+        self.last = np.full(len(drefs), np.nan)
+        # Changed since the last flush
+        self.pending = np.zeros(len(drefs), dtype=bool)
+        # Upstream index per entry, assigned by the hub
+        self.indexes = np.zeros(len(drefs), dtype=np.intp)
+
+    def transform(self, raw: np.ndarray):
+        """Transform upstream values into `last`, marking changes pending
+
+        Returns whether anything changed and whether a discrete value did
+        """
+        values = raw[self.indexes] * self.scale + self.offset
+        values = np.where(
+            self.rounded,
+            np.round(values * self.round_factor) / self.round_factor,
+            values,
+        )
+        changed = ~(np.abs(values - self.last) <= self.deadband) & ~np.isnan(values)
+        self.last[changed] = values[changed]
+        self.pending |= changed
+        return changed.any(), (changed & self.discrete).any()
+
+    def take_pending(self):
+        """Pending `(slots, values)` accumulated since the last flush"""
+        pending = self.pending
+        self.pending = np.zeros(len(pending), dtype=bool)
+        return self.slots[pending], self.last[pending]
+
+    def refresh(self):
+        self.pending[:] = False
+        valid = ~np.isnan(self.last)
+        return self.slots[valid], self.last[valid]
+
+
+RREF_HEADER = b"RREF,"
+RREF_DTYPE = np.dtype([("index", "<i4"), ("value", "<f4")])
+# Stay well inside a single ethernet frame
+MAX_VALUES = 128
+
+# v2 framing: header, sequence, flags, count then `<Bf>` slot / value pairs
+RRF2_HEADER = struct.Struct("<4sHBB")
+RRF2_DTYPE = np.dtype([("slot", "u1"), ("value", "<f4")])
+RRF2_KEYFRAME = 0x01
+
+
+class Hub:
+    """Single deduplicated X-Plane subscription shared by all clients
+
+    Clients are keyed by IP, so a panel that reboots or sends HELLO from a
+    random source port replaces its previous registration
+    """
+
+    def __init__(self, profiles: dict[str, list[ProfileDref]], default_aircraft: str):
+        self.profiles = profiles
+        self.default_aircraft = default_aircraft
+        self._clients: dict[str, Client] = {}
+        self._indexes: dict[bytes, int] = {}
+        self._names: dict[int, bytes] = {}
+        self._freqs: dict[int, int] = {}
+        # Raw upstream values by RREF index
+        self._raw = np.full(1, np.nan)
 
     @property
-    def lock(self):
-        return self._lock
+    def clients(self):
+        return list(self._clients.values())
+
+    def client(self, ip: str):
+        return self._clients.get(ip)
+
+    def register(
+        self, address: tuple[str, int], drefs: list[ProfileDref], version: int = 1
+    ):
+        """Register or replace the client at `address[0]`, sending to `address`
+
+        Returns the client and RREF changes `(freq, index, name)`
+        """
+        logger.info(f"Client {address[0]}:{address[1]} {len(drefs)} drefs v{version}")
+        client = Client(address, drefs, version)
+        self._clients[address[0]] = client
+        changes = self._rebuild()
+        # Seed from values already shared with other clients
+        client.transform(self._raw)
+        return client, changes
+
+    def _rebuild(self):
+        wanted: dict[bytes, int] = {}
+        for client in self._clients.values():
+            for dref in client.drefs:
+                wanted[dref.dataref] = max(dref.rate, wanted.get(dref.dataref, 0))
+
+        changes = []
+        for name, index in list(self._indexes.items()):
+            if name not in wanted:
+                changes.append((0, index, name))
+                del self._indexes[name]
+                del self._names[index]
+                del self._freqs[index]
+                self._raw[index] = np.nan
+
+        for name, freq in wanted.items():
+            index = self._indexes.get(name)
+            if index is None:
+                index = max(self._names.keys(), default=0) + 1
+                self._indexes[name] = index
+                self._names[index] = name
+            if self._freqs.get(index) != freq:
+                self._freqs[index] = freq
+                changes.append((freq, index, name))
+
+        size = max(self._names.keys(), default=0) + 1
+        if size > len(self._raw):
+            self._raw = np.concatenate(
+                [self._raw, np.full(size - len(self._raw), np.nan)]
+            )
+
+        for client in self._clients.values():
+            client.indexes[:] = [self._indexes[dref.dataref] for dref in client.drefs]
+        return changes
+
+    def subscriptions(self):
+        return [
+            (freq, index, self._names[index]) for index, freq in self._freqs.items()
+        ]
+
+    def update(self, data: bytes):
+        """Store an upstream RREF payload, returns changed `(client, discrete)`"""
+        drefs = np.frombuffer(data, dtype=RREF_DTYPE)
+        indexes = drefs["index"]
+        known = (indexes > 0) & (indexes < len(self._raw))
+        self._raw[indexes[known]] = drefs["value"][known]
+
+        changed = []
+        for client in self._clients.values():
+            any_changed, discrete = client.transform(self._raw)
+            if any_changed:
+                changed.append((client, discrete))
+        return changed
+
+
+class Relay:
+    """Forwards hub values to clients from a single selector loop
+
+    X-Plane, client and beacon sockets are all non-blocking and serviced
+    by one thread, so client refreshes are answered as they arrive rather
+    than on the next upstream packet.
+
+    Changes are accumulated per client and flushed at most once per
+    `frame_interval`, discrete values flush immediately.
+    """
+
+    def __init__(
+        self,
+        hub: Hub,
+        bind_ip: str,
+        esp_port: int,
+        beacon_timeout: float = 3.0,
+        keyframe_interval: float = 2.0,
+        frame_interval: float = 0.04,
+    ):
+        self._hub = hub
+        self._esp_port = esp_port
+        self._frame_interval = frame_interval
+        self._beacon_timeout = beacon_timeout
+        self._keyframe_interval = keyframe_interval
+        self._xplane_address = None
+        self._last_beacon = 0
+        self._running = True
+
+        self._out = bytearray(len(RREF_HEADER) + RREF_DTYPE.itemsize * MAX_VALUES)
+        self._out[: len(RREF_HEADER)] = RREF_HEADER
+        self._out_view = memoryview(self._out)
+        self._out_values = np.frombuffer(
+            self._out, dtype=RREF_DTYPE, offset=len(RREF_HEADER)
+        )
+        self._out2 = bytearray(RRF2_HEADER.size + RRF2_DTYPE.itemsize * MAX_VALUES)
+        self._out2_view = memoryview(self._out2)
+        self._out2_values = np.frombuffer(
+            self._out2, dtype=RRF2_DTYPE, offset=RRF2_HEADER.size
+        )
+
+        self._esp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._esp_sock.bind((bind_ip, esp_port))
+        self._xplane_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._beacon_sock = beacon_socket()
+
+        self._selector = selectors.DefaultSelector()
+        for sock, handler in [
+            (self._esp_sock, self._client_received),
+            (self._xplane_sock, self._xplane_received),
+            (self._beacon_sock, self._beacon_received),
+        ]:
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ, handler)
+
+    def stop(self):
+        self._running = False
+
+    def send_values(
+        self,
+        client: Client,
+        slots: np.ndarray,
+        values: np.ndarray,
+        keyframe: bool = False,
+    ):
+        if client.version == 2:
+            return self._send_values_v2(client, slots, values, keyframe)
+
+        address = client.address
+        start = len(RREF_HEADER)
+        for chunk in range(0, len(slots), MAX_VALUES):
+            count = min(MAX_VALUES, len(slots) - chunk)
+            self._out_values["index"][:count] = slots[chunk : chunk + count]
+            self._out_values["value"][:count] = values[chunk : chunk + count]
+            self._esp_sock.sendto(
+                self._out_view[: start + count * RREF_DTYPE.itemsize], address
+            )
+
+    def _send_values_v2(
+        self, client: Client, slots: np.ndarray, values: np.ndarray, keyframe: bool
+    ):
+        flags = RRF2_KEYFRAME if keyframe else 0
+        if keyframe:
+            client.last_keyframe = time.monotonic()
+
+        # An empty keyframe still tells the panel where the sequence is
+        for chunk in range(0, max(len(slots), 1 if keyframe else 0), MAX_VALUES):
+            count = min(MAX_VALUES, len(slots) - chunk)
+            RRF2_HEADER.pack_into(self._out2, 0, b"RRF2", client.sequence, flags, count)
+            self._out2_values["slot"][:count] = slots[chunk : chunk + count]
+            self._out2_values["value"][:count] = values[chunk : chunk + count]
+            self._esp_sock.sendto(
+                self._out2_view[: RRF2_HEADER.size + count * RRF2_DTYPE.itemsize],
+                client.address,
+            )
+            client.sequence = (client.sequence + 1) & 0xFFFF
+
+    def send_keyframe(self, client: Client):
+        client.last_flush = time.monotonic()
+        self.send_values(client, *client.refresh(), keyframe=True)
+
+    def flush(self, client: Client):
+        client.last_flush = time.monotonic()
+        self.send_values(client, *client.take_pending())
+
+    def _flush_due(self):
+        """Flush clients whose frame has elapsed, returns seconds to the next"""
+        now = time.monotonic()
+        wait = None
+        for client in self._hub.clients:
+            if not client.pending.any():
+                continue
+            remaining = client.last_flush + self._frame_interval - now
+            if remaining <= 0:
+                self.flush(client)
+            elif wait is None or remaining < wait:
+                wait = remaining
+        return wait
+
+    def _subscribe(self, subscriptions: list[tuple[int, int, bytes]]):
+        if not self._xplane_address:
+            return
+        for freq, index, name in subscriptions:
+            msg = struct.pack("<4sxii400s", b"RREF", freq, index, name)
+            self._xplane_sock.sendto(msg, self._xplane_address)
+
+    def _beacon_received(self, sock: socket.socket):
+        packet, sender = sock.recvfrom(15000)
+        beacon = parse_beacon(packet, sender)
+        if not beacon:
+            return
+
+        self._last_beacon = time.monotonic()
+        address = (beacon["ip"], beacon["port"])
+        if address != self._xplane_address:
+            logger.info(f"Beacon available {address[0]}:{address[1]}")
+            self._xplane_address = address
+            logger.info(f"Subscribing for {len(self._hub.clients)} clients")
+            self._subscribe(self._hub.subscriptions())
+
+    def _client_received(self, sock: socket.socket):
+        data, address = sock.recvfrom(2048)
+        logger.info("ESP: %s %s", data, address)
+        if data.startswith(b"HELLO"):
+            drefs, version, port = parse_hello(
+                data, self._hub.profiles, self._hub.default_aircraft
+            )
+            if drefs:
+                # The source port is arbitrary, reply to the port it listens on
+                client, changes = self._hub.register(
+                    (address[0], port or self._esp_port), drefs, version
+                )
+                self._subscribe(changes)
+                logger.info(f"Refresh all {address[0]}")
+                self.send_keyframe(client)
+
+        elif data.startswith(b"NACK"):
+            client = self._hub.client(address[0])
+            if client and time.monotonic() - client.last_keyframe >= NACK_INTERVAL:
+                logger.info(f"NACK {address[0]} {data[5:]}")
+                self.send_keyframe(client)
+
+    def _xplane_received(self, sock: socket.socket):
+        while True:
+            try:
+                data = sock.recv(2048)
+            except BlockingIOError:
+                return
+
+            if data[:4] == b"RREF":
+                now = time.monotonic()
+                for client, discrete in self._hub.update(memoryview(data)[5:]):
+                    if discrete or now - client.last_flush >= self._frame_interval:
+                        self.flush(client)
+
+    def _check_beacon(self):
+        if (
+            self._xplane_address
+            and time.monotonic() - self._last_beacon > self._beacon_timeout
+        ):
+            logger.info("Beacon lost")
+            self._xplane_address = None
+
+    def _check_keyframes(self):
+        now = time.monotonic()
+        for client in self._hub.clients:
+            if (
+                client.version == 2
+                and now - client.last_keyframe > self._keyframe_interval
+            ):
+                self.send_keyframe(client)
+
+    def run(self):
+        timeout = 0.5
+        while self._running:
+            for key, _ in self._selector.select(timeout=timeout):
+                try:
+                    key.data(key.fileobj)
+                except Exception:
+                    # One bad datagram must not stop the relay
+                    logger.exception("Error handling datagram")
+            self._check_beacon()
+            self._check_keyframes()
+            wait = self._flush_due()
+            timeout = 0.5 if wait is None else min(wait, 0.5)
+
+        self._selector.close()
+        for sock in [self._esp_sock, self._xplane_sock, self._beacon_sock]:
+            sock.close()
 
 
 if __name__ == "__main__":
@@ -147,119 +560,35 @@ if __name__ == "__main__":
     ip_addr = socket.gethostbyname(hostname)
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("-a", "--aircraft", choices=DREFS.keys(), default="a320")
+    parser.add_argument("-a", "--aircraft", default="a320")
+    parser.add_argument("--profiles", type=Path, default=PROFILES_PATH)
     parser.add_argument("--esp-port", type=int, default=55678)
-    parser.add_argument("--esp-ip", type=str, default="192.168.1.199")
+    parser.add_argument(
+        "--esp-ip",
+        type=str,
+        default="192.168.1.199",
+        help="Client registered at startup, others register with HELLO",
+    )
     parser.add_argument("--bind-ip", type=str, default=ip_addr)
+    parser.add_argument(
+        "--frame-interval",
+        type=float,
+        default=0.04,
+        help="Minimum seconds between updates sent to a client",
+    )
 
     args = parser.parse_args()
 
-    dref_buffer = {}
-
-    esp_sock_lock = threading.Lock()
-    esp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    esp_sock.bind((args.bind_ip, args.esp_port))
+    profiles = load_profiles(args.profiles)
+    if args.aircraft not in profiles:
+        parser.error(f"No profile for `{args.aircraft}` in {args.profiles}")
 
-    xplane_sock_lock = threading.Lock()
-    xplane_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-    client_state = ClientState()
-
-    def subscribe(cl_state: ClientState):
-        while cl_state.running:
-            logger.debug(f"Subscribe thread running {cl_state.running}")
-            if cl_state.should_subscribe and cl_state.xplane_address:
-                logger.info(f"Subscribing for `{args.aircraft}`")
-                with xplane_sock_lock:
-                    for message in DREFS[args.aircraft]:
-                        msg = struct.pack(
-                            "<4sxii400s", b"RREF", message[1], message[2], message[0]
-                        )
-                        xplane_sock.sendto(msg, cl_state.xplane_address)
-
-                with cl_state.lock:
-                    cl_state.should_subscribe = False
-
-            time.sleep(1)
-
-    def listen_beacon(cl_state: ClientState):
-        while cl_state.running:
-            logger.debug(f"Beacon thread running {cl_state.running}")
-            try:
-                beacon = find_xp()
-                with cl_state.lock:
-                    if not cl_state.xplane_address:
-                        logger.info("Baacon available")
-                    cl_state.xplane_address = (beacon["ip"], beacon["port"])
-
-            except XPlaneIpNotFound:
-                if not cl_state.should_subscribe:
-                    with cl_state.lock:
-                        cl_state.should_subscribe = True
-                        cl_state.xplane_address = []
-        time.sleep(1)
-
-    def listen_client(cl_state: ClientState):
-        # esp_sock.setblocking(0)
-        while cl_state.running:
-            logger.debug(f"Client thread running {cl_state.running}")
-            ready = select.select([esp_sock], [], [], 2)
-            if ready:
-                data1, addr1 = esp_sock.recvfrom(2048)
-                logger.info("ESP: %s %s", data1, addr1)
-                if data1:
-                    with cl_state.lock:
-                        cl_state.refresh_all = True
-            else:
-                time.sleep(1)
-
-    beacon_thread = threading.Thread(target=listen_beacon, args=(client_state,))
-    beacon_thread.start()
-
-    subscribe_thread = threading.Thread(target=subscribe, args=(client_state,))
-    subscribe_thread.start()
-
-    client_thread = threading.Thread(target=listen_client, args=(client_state,))
-    client_thread.start()
+    hub = Hub(profiles, args.aircraft)
+    if args.esp_ip:
+        hub.register((args.esp_ip, args.esp_port), profiles[args.aircraft])
 
+    relay = Relay(hub, args.bind_ip, args.esp_port, frame_interval=args.frame_interval)
     try:
-        while True:
-            data, addr = xplane_sock.recvfrom(2048)
-            header = data[:4]
-            if header == b"RREF":
-                dref_bytes = data[5:]
-                drefs = [list(v) for v in struct.iter_unpack("<if", dref_bytes)]
-                changed = []
-                for dref in drefs:
-                    if dref[0] == 11:
-                        dref[1] *= 33.864
-                    if dref[0] in [2, 4]:
-                        dref[1] = round(dref[1])
-                    if dref[0] in dref_buffer:
-                        if dref[1] != dref_buffer[dref[0]]:
-                            changed.append(dref)
-                    else:
-                        changed.append(dref)
-                    dref_buffer[dref[0]] = dref[1]
-
-                if changed:
-                    bytes = b"RREF,"
-                    for value in changed:
-                        bytes += struct.pack("<if", value[0], value[1])
-                    # print(changed)
-                    esp_sock.sendto(bytes, (args.esp_ip, args.esp_port))
-
-                if client_state.refresh_all:
-                    logger.info("Refresh all")
-                    bytes = b"RREF,"
-                    for key, value in dref_buffer.items():
-                        bytes += struct.pack("<if", key, value)
-                    esp_sock.sendto(bytes, (args.esp_ip, args.esp_port))
-                    client_state.refresh_all = False
-
+        relay.run()
     except KeyboardInterrupt:
-        with client_state.lock:
-            client_state.running = False
-        beacon_thread.join()
-        subscribe_thread.join()
-        client_thread.join()
+        relay.stop()
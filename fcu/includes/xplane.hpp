@@ -17,6 +17,74 @@ typedef struct rref_data_type
   float val;
 } rref_data_type;
 
+// Relay protocol v2, selected by sending "HELLO,v2" (or "HELLO,<aircraft>,v2")
+//
+// Each packet is an rrf2_header_type followed by `count` rrf2_data_type
+// records. `seq` increments by one per packet (wrapping at 65535). Packets
+// flagged RRF2_KEYFRAME carry every known value. On a sequence gap send
+// "NACK,<expected seq>" once and the relay answers with a keyframe; keyframes
+// are also sent periodically so a lost NACK still converges.
+#define RRF2_KEYFRAME 0x01
+
+#pragma pack(push, 1)
+typedef struct rrf2_header_type
+{
+  char cmd[4];
+  uint16_t seq;
+  uint8_t flags;
+  uint8_t count;
+} rrf2_header_type;
+
+typedef struct rrf2_data_type
+{
+  uint8_t idx;
+  float val;
+} rrf2_data_type;
+#pragma pack(pop)
+
+// Parse a v2 packet, calling `publish` per value. Returns false when a
+// packet was missed and the caller should send a NACK with `expected_seq`,
+// only once per gap: later packets are applied until a keyframe resyncs
+bool parse_rrf2(std::vector<uint8_t> &data, uint16_t &expected_seq, bool &synced,
+                std::function<void(uint8_t, float)> publish)
+{
+  if (data.size() < sizeof(rrf2_header_type) || memcmp(data.data(), "RRF2", 4) != 0)
+  {
+    return true;
+  }
+
+  rrf2_header_type *header = reinterpret_cast<rrf2_header_type *>(&data[0]);
+  bool keyframe = header->flags & RRF2_KEYFRAME;
+  bool in_order = synced && header->seq == expected_seq;
+  if (keyframe)
+  {
+    synced = true;
+  }
+  expected_seq = header->seq + 1;
+
+  uint8_t count = std::min<size_t>(
+      header->count, (data.size() - sizeof(rrf2_header_type)) / sizeof(rrf2_data_type));
+  rrf2_data_type *f = reinterpret_cast<rrf2_data_type *>(&data[sizeof(rrf2_header_type)]);
+  for (uint8_t j = 0; j < count; j += 1)
+  {
+    publish(f[j].idx, f[j].val);
+  }
+
+  if (!keyframe && !in_order)
+  {
+    bool nack_due = synced;
+    synced = false;
+    return !nack_due;
+  }
+  return true;
+}
+
+std::vector<uint8_t> nack(uint16_t expected_seq)
+{
+  std::string msg = "NACK," + to_string(expected_seq);
+  return std::vector<uint8_t>(msg.begin(), msg.end());
+}
+
 std::vector<uint8_t> subscribe(std::string dref, uint32_t freq, uint32_t index)
 {
   rref_request_type req{"RREF", freq, index};
@@ -74,3 +142,23 @@ std::vector<uint8_t> subscribe(std::string dref, uint32_t freq, uint32_t index)
 //     }
 //   }
 // }
+
+// Panel input, sent from the ESP to the relay: "INPT" followed by one or
+// more input_data_type records. Encoders send signed ticks since the last
+// packet, push / pull buttons 1 for push and -1 for pull, plain buttons 1.
+#pragma pack(push, 1)
+typedef struct input_data_type
+{
+  uint8_t control;
+  int16_t value;
+} input_data_type;
+#pragma pack(pop)
+
+std::vector<uint8_t> input(uint8_t control, int16_t value)
+{
+  input_data_type record{control, value};
+  std::vector<uint8_t> bytes = {'I', 'N', 'P', 'T'};
+  uint8_t *raw = reinterpret_cast<uint8_t *>(&record);
+  bytes.insert(bytes.end(), raw, raw + sizeof(record));
+  return bytes;
+}
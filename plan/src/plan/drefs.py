@@ -0,0 +1,162 @@
+from dataclasses import dataclass
+import re
+import time
+
+
+@dataclass
+class DrefFilter:
+    """Change suppression applied on top of the `,precision` rounding
+
+    - deadband: minimum absolute change from the last emitted value
+    - relative: minimum change as a fraction of the last emitted value
+    - hysteresis: distance the raw value must be past a rounding boundary
+    - min_interval: minimum seconds between two emitted changes
+    """
+
+    deadband: float = 0.0
+    relative: float = 0.0
+    hysteresis: float = 0.0
+    min_interval: float = 0.0
+
+    def apply(self, entry: "DrefEntry", raw: float, previous: float | None):
+        value = raw if entry.precision is None else round(raw, entry.precision)
+        if previous is None:
+            entry.last_emit = time.monotonic()
+            return value
+        if value == previous:
+            return
+
+        now = time.monotonic()
+        if now - entry.last_emit < self.min_interval:
+            return
+
+        delta = abs(raw - previous)
+        if delta <= self.deadband:
+            return
+        if self.relative and delta <= self.relative * abs(previous):
+            return
+        if self.hysteresis and entry.precision is not None:
+            if delta < 0.5 * 10**-entry.precision + self.hysteresis:
+                return
+
+        entry.last_emit = now
+        return value
+
+
+@dataclass
+class DrefEntry:
+    key: str
+    name: str
+    index: int | None = None
+    precision: int | None = None
+    scale: float = 1.0
+    rate: int | None = None
+    # Number of elements of an array slice, `None` for a single value
+    length: int | None = None
+    slot: int | None = None
+    filter: DrefFilter | None = None
+    last_emit: float = 0
+
+    @property
+    def rref(self):
+        if self.index is None:
+            return self.name
+        return f"{self.name}[{self.index}]"
+
+    @property
+    def slot_range(self):
+        return range(self.slot, self.slot + (self.length or 1))
+
+    def rref_at(self, slot: int):
+        if self.length is None:
+            return self.rref
+        return f"{self.name}[{self.index + slot - self.slot}]"
+
+
+def parse_dref(dref: str):
+    """Parse a dataref spec `name[index],precision,scale@rate`
+
+    Only the name is required, e.g. `sim/cockpit/misc/barometer_setting,2,33.864`
+    or `sim/cockpit/autopilot/heading_mag,0@20`. An array slice
+    `name[start:end]` subscribes each element in the range
+    """
+    spec, _, rate = dref.partition("@")
+    dref_and_opts = spec.split(",")
+    name = dref_and_opts[0]
+    index = None
+    length = None
+    match = re.search(r"\[(\d+)(?::(\d+))?\]$", name)
+    if match:
+        name = name[: match.start()]
+        index = int(match.group(1))
+        if match.group(2) is not None:
+            length = int(match.group(2)) - index
+            if length <= 0:
+                raise ValueError(f"Empty dataref slice `{dref}`")
+
+    precision = None
+    if len(dref_and_opts) > 1 and dref_and_opts[1]:
+        precision = int(dref_and_opts[1])
+
+    scale = 1.0
+    if len(dref_and_opts) > 2 and dref_and_opts[2]:
+        scale = float(dref_and_opts[2])
+
+    return DrefEntry(
+        key=dref,
+        name=name,
+        index=index,
+        precision=precision,
+        scale=scale,
+        rate=int(rate) if rate else None,
+        length=length,
+    )
+
+
+class DrefListeners:
+    """Callbacks registered per dataref key
+
+    `listen` callbacks are called with `(dref, value)` for their own key only,
+    `listen_batch` callbacks once per update with all changed values, or with
+    just the changed values of `drefs` when given
+    """
+
+    def __init__(self):
+        self._listeners: dict[str, list[callable]] = {}
+        self._batch: list[callable] = []
+        self._batch_by_dref: dict[str, list[int]] = {}
+        self._unfiltered: list[callable] = []
+
+    def listen(self, dref: str, callback: callable):
+        self._listeners.setdefault(dref, []).append(callback)
+
+    def unlisten(self, dref: str, callback: callable):
+        callbacks = self._listeners.get(dref, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self._listeners.pop(dref, None)
+
+    def listen_batch(self, callback: callable, drefs: list[str] = None):
+        if drefs is None:
+            self._unfiltered.append(callback)
+            return
+
+        batch_id = len(self._batch)
+        self._batch.append(callback)
+        for dref in set(drefs):
+            self._batch_by_dref.setdefault(dref, []).append(batch_id)
+
+    def dispatch(self, changed: dict[str, any]):
+        batches: dict[int, dict[str, any]] = {}
+        for dref, value in changed.items():
+            for callback in self._listeners.get(dref, ()):
+                callback(dref, value)
+            for batch_id in self._batch_by_dref.get(dref, ()):
+                batches.setdefault(batch_id, {})[dref] = value
+
+        for batch_id, batch in batches.items():
+            self._batch[batch_id](batch)
+
+        for callback in self._unfiltered:
+            callback(changed)
@@ -28,7 +28,7 @@ class Plan:
         self, apt: APT, update_time: callable = None, update_location: callable = None
     ):
         self._fms = FMS(apt)
-        self._rest = REST(on_drefs_changed=self.on_drefs_changed)
+        self._rest = REST()
         self._weather = Weather()
         self._plan = None
         self._to = TOCalculator(self._rest, apt, self._weather)
@@ -44,16 +44,16 @@ class Plan:
         ]
         self._update_time = update_time
         self._update_location = update_location
+        self._rest.listen(self._time_dref, self.on_time_changed)
+        self._rest.listen_batch(self.on_location_changed, self._location_drefs)
 
-    def on_drefs_changed(self, drefs: dict[str, any]):
-        for dref in drefs:
-            if dref == self._time_dref:
-                if self._update_time:
-                    self._update_time()
+    def on_time_changed(self, dref: str, value: float):
+        if self._update_time:
+            self._update_time()
 
-            if dref in self._location_drefs:
-                if self._update_location:
-                    self._update_location()
+    def on_location_changed(self, drefs: dict[str, any]):
+        if self._update_location:
+            self._update_location()
 
     async def _init(self):
         await self._rest._init()
@@ -12,6 +12,8 @@ import httpx
 import websockets
 from websockets.asyncio.client import connect
 
+from .drefs import DrefEntry, DrefFilter, DrefListeners, parse_dref
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
@@ -75,7 +77,16 @@ def get_dref_and_index(dataref: str):
 
 
 class REST:
-    def __init__(self, on_drefs_changed: callable = None):
+    """X-Plane REST / websocket client
+
+    `filters` maps dataref keys to a `DrefFilter`, as for `dref.udp.UDP`
+    """
+
+    def __init__(
+        self,
+        on_drefs_changed: callable = None,
+        filters: dict[str, DrefFilter] = None,
+    ):
         self._client = httpx.AsyncClient(verify=False)
         self._base_url = "http://localhost:8086/api/v3"
         self._commands = "/commands"
@@ -85,9 +96,16 @@ class REST:
         self.__datarefs: dict[str, dict[str, any]] = {}
 
         self._dataref_cache = {}
+        self._dref_entries: dict[str, DrefEntry] = {}
+        self._filters = filters or {}
+        # Raw values held back by a filter's `min_interval`, by dataref key
+        self._trailing: dict[str, float] = {}
+        self._trailing_handles: dict[str, asyncio.TimerHandle] = {}
         self._websocket_running = True
         self._websocket = None
-        self._on_drefs_changed = on_drefs_changed
+        self._listeners = DrefListeners()
+        if on_drefs_changed:
+            self._listeners.listen_batch(on_drefs_changed)
 
         self._xplane_running = False
         self._xplane_ready = False
@@ -250,9 +268,18 @@ class REST:
             return True
         return False
 
+    @property
+    def subscribed_drefs(self):
+        return list(self._dref_cache)
+
     def set_subscribed_drefs(self, drefs: list[str]):
         drefs.sort()
         self._dref_cache = {key: None for key in drefs}
+        self._dref_entries = {}
+        for key in drefs:
+            entry = parse_dref(key)
+            entry.filter = self._filters.get(key)
+            self._dref_entries[key] = entry
 
     def _get_dref_by_id_and_index(self, id: int, index: int = 0):
         dataref = None
@@ -271,16 +298,13 @@ class REST:
 
     async def _subscribe(self):
         dref_by_root = {}
-        for dref in self._dref_cache.keys():
-            dref_and_opts = dref.split(",")
-            match = re.search(r"\[(\d+)\]", dref_and_opts[0])
-            if match:
-                dref_key = re.sub(r"\[\d+\]", "", dref_and_opts[0])
-                if dref_key not in dref_by_root:
-                    dref_by_root[dref_key] = []
-                dref_by_root[dref_key].append(int(match.group(1)))
+        for entry in self._dref_entries.values():
+            if entry.index is not None:
+                if entry.name not in dref_by_root:
+                    dref_by_root[entry.name] = []
+                dref_by_root[entry.name].append(entry.index)
             else:
-                dref_by_root[dref_and_opts[0]] = []
+                dref_by_root[entry.name] = []
 
         datarefs = []
         for dref, indexes in dref_by_root.items():
@@ -300,33 +324,84 @@ class REST:
         await self._websocket.send(message)
         self._xplane_ready = True
 
-    def _update_dref_cache(self, dref_key: str, value: int):
-        dref_opts = dref_key.split(",")
-        if len(dref_opts) > 1:
-            value = round(value, int(dref_opts[1]))
+    def listen(self, dref: str, callback: callable):
+        self._listeners.listen(dref, callback)
+
+    def unlisten(self, dref: str, callback: callable):
+        self._listeners.unlisten(dref, callback)
+
+    def listen_batch(self, callback: callable, drefs: list[str] = None):
+        self._listeners.listen_batch(callback, drefs)
+
+    def _update_dref_cache(self, dref_key: str, value: int, changed: dict[str, any]):
+        entry = self._dref_entries[dref_key]
+        if entry.scale != 1.0:
+            value *= entry.scale
 
         current_value = self._dref_cache[dref_key]
-        changed = {}
+        if entry.filter is not None:
+            # The filter rounds itself so it can see the raw value
+            filtered = entry.filter.apply(entry, value, current_value)
+            if filtered is not None:
+                self._trailing.pop(dref_key, None)
+                self._dref_cache[dref_key] = filtered
+                changed[dref_key] = filtered
+            elif entry.filter.min_interval:
+                self._schedule_trailing(entry, value)
+            return
+
+        if entry.precision is not None:
+            value = round(value, entry.precision)
+
         if current_value != value:
             self._dref_cache[dref_key] = value
             changed[dref_key] = value
             # print(dref_key, value)
 
-        if changed:
-            if self._on_drefs_changed:
-                self._on_drefs_changed(changed)
+    def _schedule_trailing(self, entry: DrefEntry, raw: float):
+        """Re-evaluate a held back value once `min_interval` has passed
+
+        The websocket only sends changed values, so without this the last
+        value of a burst could stay stale
+        """
+        self._trailing[entry.key] = raw
+        if entry.key in self._trailing_handles:
+            return
+        delay = entry.last_emit + entry.filter.min_interval - time.monotonic()
+        self._trailing_handles[entry.key] = asyncio.get_running_loop().call_later(
+            max(delay, 0), self._emit_trailing, entry
+        )
+
+    def _emit_trailing(self, entry: DrefEntry):
+        self._trailing_handles.pop(entry.key, None)
+        raw = self._trailing.pop(entry.key, None)
+        if raw is None or self._dref_entries.get(entry.key) is not entry:
+            return
+        if time.monotonic() - entry.last_emit < entry.filter.min_interval:
+            # Timer fired early
+            self._schedule_trailing(entry, raw)
+            return
+
+        value = entry.filter.apply(entry, raw, self._dref_cache[entry.key])
+        if value is not None:
+            self._dref_cache[entry.key] = value
+            self._listeners.dispatch({entry.key: value})
 
     def _parse_socket_response(self, data: dict[str, any]):
         if data["type"] == "dataref_update_values":
+            changed = {}
             for id, values in data["data"].items():
                 if isinstance(values, list):
                     for idx, value in enumerate(values):
                         dref_key = self._get_dref_by_id_and_index(int(id), idx)
-                        self._update_dref_cache(dref_key, value)
+                        self._update_dref_cache(dref_key, value, changed)
 
                 else:
                     dref_key = self._get_dref_by_id_and_index(int(id))
-                    self._update_dref_cache(dref_key, values)
+                    self._update_dref_cache(dref_key, values, changed)
+
+            if changed:
+                self._listeners.dispatch(changed)
 
     async def socket_client(self):
         url = self._base_url.replace("http://", "ws://")